@@ -0,0 +1,424 @@
+# Load test for the API. Seeds a scratch database through the models, drives
+# request mixes with concurrent httpx clients and prints a JSON report with
+# throughput and latency percentiles per route, for comparing commits:
+#
+#   python benchmark.py --events 5000 --duration 15 --output before.json
+#
+# By default the app runs in-process against a fresh SQLite file; --database
+# points at another stand-in (e.g. a local MySQL, wiped and reseeded only with
+# --reset) and --url at a running server that uses that same database.
+
+import argparse
+import asyncio
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import orjson
+
+
+SCENARIOS = ("browse", "favorites", "like_storm", "login")
+
+PASSWORD = "benchmark"
+HOT_EVENTS = 10
+
+VENUE_TYPES = ("museum", "theatre", "library", "cinema", "comedy_club", "monument", "cultural_space")
+EVENT_TYPES = ("theatre", "concert", "exhibition", "book_fare", "seminar", "festival", "dance",
+    "comedy", "cinema")
+WORDS = ("jazz", "opera", "baku", "night", "festival", "modern", "classic", "art", "film", "city",
+    "old", "house", "carpet", "museum", "stage", "piano", "spring", "poetry", "dance", "gallery")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test for the API")
+
+    parser.add_argument("--database", help="sync SQLAlchemy URL, defaults to a scratch SQLite file")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--no-seed", action="store_true", help="reuse an already seeded database")
+    parser.add_argument("--reset", action="store_true",
+        help="allow seeding to drop every table of the --database given")
+
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--venues", type=int, default=200)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--likes", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=5000)
+
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+        help=f"comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds per scenario")
+    parser.add_argument("--sessions", type=int, default=32, help="users logged in before the run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the report here instead of stdout")
+
+    return parser.parse_args()
+
+
+# Seeding
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def unique_pairs(rng: random.Random, count: int, owners: int, targets: int) -> list[tuple[int, int]]:
+    count = min(count, owners * targets)
+    pairs = set()
+
+    while len(pairs) < count:
+        pairs.add((rng.randint(1, owners), rng.randint(1, targets)))
+
+    return sorted(pairs)
+
+
+def seed(args):
+    from sqlalchemy import insert
+
+    from database import engine, sessionLocal, Base
+    from geo import geo_cell
+    from hashing import bcrypt_context
+    from migrate import upgrade
+    from models import User, Venue, Event, EventLike, VenueLike, EventComment, VenueComment
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as connection:
+        upgrade(connection, None)
+
+    # One real hash shared by every user keeps logins honest without seeding cost
+    hashed_password = bcrypt_context.hash(PASSWORD)
+
+    users = [dict(username=f"user{i}", first_name="Bench", last_name=f"User{i}",
+        hashed_password=hashed_password, is_organizer=i % 10 == 1) for i in range(1, args.users + 1)]
+
+    venues = []
+    for i in range(1, args.venues + 1):
+        lat, lng = 40.35 + rng.random() * 0.1, 49.8 + rng.random() * 0.15
+        venues.append(dict(name=f"Venue {i} {words(rng, 2)}", description=words(rng, 12),
+            venue_type=rng.choice(VENUE_TYPES), lat=lat, lng=lng, geo_cell=geo_cell(lat, lng)))
+
+    events = []
+    for i in range(1, args.events + 1):
+        date = now + timedelta(days=rng.randint(-60, 120), hours=rng.randint(0, 23))
+        events.append(dict(title=f"{words(rng, 3).title()} {i}", description=words(rng, 15),
+            date=date, venue_id=rng.randint(1, args.venues), organizer_id=rng.randint(1, args.users),
+            event_type=rng.choice(EVENT_TYPES), start=date.time(), finish=(date + timedelta(hours=2)).time()))
+
+    event_likes = unique_pairs(rng, args.likes, args.users, args.events)
+    venue_likes = unique_pairs(rng, args.likes // 4, args.users, args.venues)
+
+    for owner_id, event_id in event_likes:
+        events[event_id - 1]["num_likes"] = events[event_id - 1].get("num_likes", 0) + 1
+    for owner_id, venue_id in venue_likes:
+        venues[venue_id - 1]["num_likes"] = venues[venue_id - 1].get("num_likes", 0) + 1
+
+    for row in events + venues:
+        row.setdefault("num_likes", 0)
+
+    def created_at():
+        return now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600))
+
+    with sessionLocal() as db:
+        for model, rows in (
+                (User, users),
+                (Venue, venues),
+                (Event, events),
+                (EventLike, [dict(owner_id=owner_id, event=event_id, created_at=created_at())
+                    for owner_id, event_id in event_likes]),
+                (VenueLike, [dict(owner_id=owner_id, venue=venue_id, created_at=created_at())
+                    for owner_id, venue_id in venue_likes]),
+                (EventComment, [dict(owner_id=rng.randint(1, args.users), event=rng.randint(1, args.events),
+                    content=words(rng, 8), created_at=created_at()) for _ in range(args.comments)]),
+                (VenueComment, [dict(owner_id=rng.randint(1, args.users), venue=rng.randint(1, args.venues),
+                    content=words(rng, 8), created_at=created_at()) for _ in range(args.comments // 4)])):
+
+            for start in range(0, len(rows), 1000):
+                db.execute(insert(model), rows[start:start + 1000])
+
+        db.commit()
+
+
+# Request mixes, each entry is (weight, route label, request builder)
+
+def browse_mix(args):
+    def event_list(rng):
+        return "GET", "/events/all", {"limit": 20}
+
+    def event_list_filtered(rng):
+        return "GET", "/events/all", {"event_type": rng.choice(EVENT_TYPES), "limit": 20}
+
+    def event_detail(rng):
+        return "GET", f"/events/{rng.randint(1, args.events)}", None
+
+    def event_comments(rng):
+        return "GET", f"/events/{rng.randint(1, args.events)}/comment", None
+
+    def event_map(rng):
+        return "GET", "/events/map", None
+
+    def venue_list(rng):
+        return "GET", "/venues/all", {"limit": 20}
+
+    def venue_detail(rng):
+        return "GET", f"/venues/{rng.randint(1, args.venues)}", None
+
+    def nearby(rng):
+        return "GET", "/venues/nearby", {"lat": 40.4, "lng": 49.87, "radius": 2}
+
+    def search(rng):
+        return "GET", "/search", {"q": rng.choice(WORDS)[:rng.randint(2, 5)]}
+
+    return [
+        (20, "GET /events/all", event_list),
+        (5, "GET /events/all?event_type", event_list_filtered),
+        (25, "GET /events/{event_id}", event_detail),
+        (10, "GET /events/{event_id}/comment", event_comments),
+        (5, "GET /events/map", event_map),
+        (10, "GET /venues/all", venue_list),
+        (10, "GET /venues/{venue_id}", venue_detail),
+        (5, "GET /venues/nearby", nearby),
+        (10, "GET /search", search),
+    ]
+
+
+def favorites_mix(args):
+    def favorites(rng):
+        return "GET", "/events/favorites", {"limit": 20}
+
+    def favorite_ids(rng):
+        return "GET", "/events/favorites/ids", None
+
+    def event_list(rng):
+        return "GET", "/events/all", {"limit": 20}
+
+    return [
+        (45, "GET /events/favorites", favorites),
+        (35, "GET /events/favorites/ids", favorite_ids),
+        (20, "GET /events/all", event_list),
+    ]
+
+
+def like_storm_mix(args):
+    # Everyone piles onto a handful of events, which is what contends on counters
+    def like(rng):
+        return "POST", "/events/like", {"event": rng.randint(1, min(HOT_EVENTS, args.events))}
+
+    def unlike(rng):
+        return "DELETE", "/events/like/delete", {"event": rng.randint(1, min(HOT_EVENTS, args.events))}
+
+    def detail(rng):
+        return "GET", f"/events/{rng.randint(1, min(HOT_EVENTS, args.events))}", None
+
+    return [
+        (50, "POST /events/like", like),
+        (30, "DELETE /events/like/delete", unlike),
+        (20, "GET /events/{event_id}", detail),
+    ]
+
+
+def login_mix(args):
+    def login(rng):
+        return "POST", "/auth/token", {"username": f"user{rng.randint(1, args.users)}", "password": PASSWORD}
+
+    return [(1, "POST /auth/token", login)]
+
+
+MIXES = {
+    "browse": browse_mix,
+    "favorites": favorites_mix,
+    "like_storm": like_storm_mix,
+    "login": login_mix,
+}
+
+
+# Driver
+
+async def log_in(client, args) -> list[dict]:
+    sessions = []
+
+    for i in range(1, min(args.sessions, args.users) + 1):
+        response = await client.post("/auth/token", json={"username": f"user{i}", "password": PASSWORD})
+        response.raise_for_status()
+        sessions.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+
+    return sessions
+
+
+async def send(client, method: str, path: str, payload, headers):
+    if method == "GET":
+        return await client.get(path, params=payload, headers=headers)
+
+    return await client.request(method, path, json=payload, headers=headers)
+
+
+async def run_scenario(client, name: str, args, sessions: list[dict]) -> dict:
+    mix = MIXES[name](args)
+    weights = [weight for weight, _, _ in mix]
+
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+
+    async def worker(number: int):
+        rng = random.Random(args.seed * 1000 + number)
+
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                return
+
+            _, label, build = rng.choices(mix, weights)[0]
+            method, path, payload = build(rng)
+            headers = rng.choice(sessions) if sessions else None
+
+            try:
+                response = await send(client, method, path, payload, headers)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+
+            elapsed = time.perf_counter() - now
+            if now >= measure_from:
+                samples[label].append(elapsed)
+                if failed:
+                    errors[label] += 1
+
+    await asyncio.gather(*(worker(number) for number in range(args.concurrency)))
+
+    return summarize(samples, errors, args.duration)
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    # Nearest rank, so the figure is always a latency that was actually observed
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))]
+
+
+def summarize(samples: dict, errors: dict, duration: float) -> dict:
+    routes = {}
+
+    for label, latencies in sorted(samples.items()):
+        ordered = sorted(latencies)
+        routes[label] = {
+            "requests": len(ordered),
+            "errors": errors[label],
+            "throughput": round(len(ordered) / duration, 2),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3),
+        }
+
+    everything = sorted(latency for latencies in samples.values() for latency in latencies)
+
+    return {
+        "requests": len(everything),
+        "errors": sum(errors.values()),
+        "throughput": round(len(everything) / duration, 2),
+        "p50_ms": round(percentile(everything, 0.50) * 1000, 3) if everything else None,
+        "p95_ms": round(percentile(everything, 0.95) * 1000, 3) if everything else None,
+        "p99_ms": round(percentile(everything, 0.99) * 1000, 3) if everything else None,
+        "routes": routes,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    import httpx
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(MIXES)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30)
+        lifespan = None
+    else:
+        import main
+
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app),
+            base_url="http://benchmark", timeout=30)
+        lifespan = main.app.router.lifespan_context(main.app)
+
+    results = {}
+    started_at = datetime.now(timezone.utc).isoformat()
+
+    async with client:
+        if lifespan is not None:
+            await lifespan.__aenter__()
+
+        try:
+            sessions = await log_in(client, args)
+
+            for name in scenarios:
+                results[name] = await run_scenario(client, name, args, sessions)
+
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+
+    return {
+        "commit": git_commit(),
+        "started_at": started_at,
+        "python": platform.python_version(),
+        "target": args.url or "in-process",
+        "database": args.database.split("://")[0],
+        "config": {key: value for key, value in vars(args).items()
+            if key not in ("output", "url", "database")},
+        "scenarios": results,
+    }
+
+
+def main():
+    args = parse_args()
+
+    # Seeding drops all tables; only the scratch file is wiped without asking
+    if args.database is not None and not args.no_seed and not args.reset:
+        raise SystemExit("Seeding drops every table in --database, pass --reset to allow it "
+            "or --no-seed to reuse its data")
+
+    if args.database is None:
+        args.database = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'api-benchmark.db')}"
+
+    # database.py reads these on import, so they are set before any app module loads
+    os.environ["URL_DATABASE"] = args.database
+    os.environ.pop("ASYNC_URL_DATABASE", None)
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("ALGORITHM", "HS256")
+
+    if not args.no_seed:
+        started = time.perf_counter()
+        seed(args)
+        print(f"Seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = orjson.dumps(asyncio.run(run(args)), option=orjson.OPT_INDENT_2)
+
+    if args.output:
+        with open(args.output, "wb") as file:
+            file.write(report)
+    else:
+        sys.stdout.buffer.write(report + b"\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import asyncio
+from collections import defaultdict
+
+from settings import LIVE_QUEUE_SIZE as QUEUE_SIZE, LIVE_LIKES_INTERVAL as LIKES_COALESCE_INTERVAL
+
+
+class Subscription:
+    # Bounded per-subscriber queue; a slow consumer loses its oldest messages
+    # instead of growing memory or slowing down publishers
+    def __init__(self, topic: str, maxsize: int = QUEUE_SIZE):
+        self.topic = topic
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def offer(self, message: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+
+        self.queue.put_nowait(message)
+
+    async def next(self) -> dict:
+        message = await self.queue.get()
+
+        if self.dropped:
+            message = {"type": "resync", "dropped": self.dropped, "next": message}
+            self.dropped = 0
+
+        return message
+
+
+class Broker:
+    # In-process pub/sub keyed by topic ("event:<id>", "venue:<id>"). Like count
+    # changes are summed per topic and published at most once per interval
+    def __init__(self, likes_interval: float = LIKES_COALESCE_INTERVAL):
+        self.topics = defaultdict(set)
+        self.likes_interval = likes_interval
+        self.pending_likes = defaultdict(int)
+        self.likes_flush = None
+
+    def subscribe(self, topic: str) -> Subscription:
+        subscription = Subscription(topic)
+        self.topics[topic].add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.topics.get(subscription.topic)
+
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.topics[subscription.topic]
+
+    def publish(self, topic: str, message: dict):
+        for subscription in self.topics.get(topic, ()):
+            subscription.offer(message)
+
+    def publish_likes(self, topic: str, delta: int):
+        if topic not in self.topics:
+            return
+
+        self.pending_likes[topic] += delta
+
+        if self.likes_flush is None:
+            self.likes_flush = asyncio.get_running_loop().call_later(
+                self.likes_interval, self._flush_likes)
+
+    def _flush_likes(self):
+        pending, self.pending_likes = self.pending_likes, defaultdict(int)
+        self.likes_flush = None
+
+        for topic, delta in pending.items():
+            if delta:
+                self.publish(topic, {"type": "likes", "delta": delta})
+
+
+broker = Broker()
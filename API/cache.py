@@ -0,0 +1,192 @@
+import hashlib
+import time
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+from typing import NamedTuple, Protocol
+from urllib.parse import urlencode
+
+import orjson
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from starlette import status
+
+from settings import REPLICA_STICKY_SECONDS, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+
+
+class TTLCache:
+    # Size bounded LRU mapping whose entries also expire ttl seconds after set().
+    # on_evict(key, value) is called for entries dropped by size or expiry
+    def __init__(self, maxsize: int, ttl: float, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return default
+
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+            return default
+
+        self.entries.move_to_end(key)
+
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            evicted, (_, value) = self.entries.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted, value)
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CacheBackend(Protocol):
+    # Backends report dropped entries through on_evict so the tag index stays in step
+    on_evict: object
+
+    def get(self, key, default=None): ...
+
+    def set(self, key, value): ...
+
+    def pop(self, key, default=None): ...
+
+    def clear(self): ...
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    tags: tuple = ()
+
+
+class ResponseCache:
+    # Serialized JSON responses keyed by path + query, each tagged with the
+    # entities it was built from so writes can drop exactly what they touch.
+    # Pages read from a replica within replica_lag seconds of one of their
+    # tags being invalidated may predate the write and are served but not
+    # stored, so writers reading from the primary never get them back
+    def __init__(self, backend: CacheBackend, replica_lag: float = REPLICA_STICKY_SECONDS):
+        self.backend = backend
+        self.backend.on_evict = self._forget
+        self.tags = defaultdict(set)
+        self.generation = 0
+        self.replica_lag = replica_lag
+        self.recently_invalidated = TTLCache(maxsize=RECENT_INVALIDATIONS, ttl=replica_lag)
+        self.cleared_at = float("-inf")
+
+    def _fresh_enough(self, request: Request, tags) -> bool:
+        db_info = getattr(request.state, "db_info", None)
+        if db_info is None or "replica_engine" not in db_info:
+            return True
+
+        if time.monotonic() - self.cleared_at < self.replica_lag:
+            return False
+
+        return not any(self.recently_invalidated.get(tag) for tag in tags)
+
+    @staticmethod
+    def key(request: Request) -> str:
+        return request.url.path + "?" + urlencode(sorted(request.query_params.multi_items()))
+
+    async def respond(self, request: Request, tags, produce, model, exclude_unset: bool = False,
+            annotate=None) -> Response:
+        key = self.key(request)
+        entry = self.backend.get(key)
+
+        if entry is None:
+            generation = self.generation
+            body = serialize(model, await produce(), exclude_unset)
+            entry = CachedResponse(body, '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"',
+                tuple(tags))
+
+            # Skip storing if an invalidation ran while the response was built
+            if generation == self.generation and self._fresh_enough(request, tags):
+                self.backend.set(key, entry)
+                for tag in tags:
+                    self.tags[tag].add(key)
+
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+
+        # Per-user fields are added to a copy of the shared cached payload
+        if annotate is not None:
+            body = orjson.dumps(annotate(orjson.loads(entry.body)))
+            entry = CachedResponse(body, '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"')
+            headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+        if etag_matches(request.headers.get("if-none-match"), entry.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    def _forget(self, key, entry: CachedResponse):
+        # Unindexes a key that left the backend, dropping tags left empty
+        for tag in entry.tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def invalidate(self, *tags):
+        self.generation += 1
+
+        for tag in tags:
+            self.recently_invalidated.set(tag, True)
+            for key in self.tags.pop(tag, ()):
+                entry = self.backend.pop(key)
+                if entry is not None:
+                    self._forget(key, entry)
+
+    def clear(self):
+        self.generation += 1
+        self.cleared_at = time.monotonic()
+        self.tags.clear()
+        self.backend.clear()
+
+
+@lru_cache(maxsize=None)
+def _adapter(model) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+def serialize(model, data, exclude_unset: bool = False) -> bytes:
+    # ORM rows are validated straight into the response model and dumped by pydantic-core
+    adapter = _adapter(model)
+
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True),
+        exclude_unset=exclude_unset)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+# Tags remembered as just invalidated; past this, replica reads of the oldest are cached again early
+RECENT_INVALIDATIONS = 4096
+
+response_cache = ResponseCache(TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL))
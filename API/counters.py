@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from sqlalchemy import update, case
+
+from cache import response_cache
+from database import asyncSessionLocal
+from models import Event, Venue
+from settings import LIKES_FLUSH_INTERVAL as FLUSH_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+
+class LikeCounter:
+    # Buffers num_likes deltas per row; flush() applies them all with one UPDATE,
+    # so concurrent likes never read-modify-write or lock the row per click
+    def __init__(self, model, tag: str):
+        self.model = model
+        self.tag = tag
+        self.pending = defaultdict(int)
+
+    def add(self, item_id: int, delta: int):
+        self.pending[item_id] += delta
+
+        if not self.pending[item_id]:
+            del self.pending[item_id]
+
+    def pending_delta(self, item_id: int) -> int:
+        return self.pending.get(item_id, 0)
+
+    async def flush(self, db):
+        if not self.pending:
+            return
+
+        deltas, self.pending = self.pending, defaultdict(int)
+
+        shifted = self.model.num_likes + case(deltas, value=self.model.id, else_=0)
+        stmt = (update(self.model)
+            .where(self.model.id.in_(deltas))
+            .values(num_likes=case((shifted < 0, 0), else_=shifted))
+            .execution_options(synchronize_session=False))
+
+        try:
+            await db.execute(stmt)
+            await db.commit()
+
+        except Exception:
+            await db.rollback()
+            for item_id, delta in deltas.items():
+                self.add(item_id, delta)
+            raise
+
+        # Counts only change here, so this is when cached reads go stale
+        response_cache.invalidate(f"{self.tag}s", *(f"{self.tag}:{item_id}" for item_id in deltas))
+
+
+event_likes = LikeCounter(Event, "event")
+venue_likes = LikeCounter(Venue, "venue")
+
+
+async def flush_all():
+    async with asyncSessionLocal() as db:
+        for counter in (event_likes, venue_likes):
+            await counter.flush(db)
+
+
+async def run_flusher(interval: float = FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            await flush_all()
+        except Exception:
+            logger.exception("Failed to flush like counters, will retry")
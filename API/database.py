@@ -1,17 +1,177 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import itertools
+import math
+import time
+from typing import Annotated
+
+from fastapi import Depends, Request, Response
+from jose import jwt, JWTError
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 
-import os
-from dotenv import load_dotenv
+from settings import (URL_DATABASE, ASYNC_URL_DATABASE, REPLICA_URL_DATABASES, REPLICA_STICKY_SECONDS,
+    POOL_SIZE, POOL_MAX_OVERFLOW, POOL_TIMEOUT, POOL_RECYCLE, POOL_PRE_PING, POOL_WARM,
+    SECRET_KEY, ALGORITHM)
+from metrics import instrument_engine
+
+
+# Sync URL drivers mapped to their asyncio counterparts
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(url: str):
+    url = make_url(url)
+
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+ASYNC_URL_DATABASE = ASYNC_URL_DATABASE or to_async_url(URL_DATABASE)
+
+
+def pool_options(url) -> dict:
+    options = {"pool_recycle": POOL_RECYCLE, "pool_pre_ping": POOL_PRE_PING}
+
+    # SQLite gets a NullPool/StaticPool, which take no sizing arguments
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+
+    return options
 
 
-load_dotenv()
-URL_DATABASE = os.getenv("URL_DATABASE")
+def enforce_foreign_keys(engine):
+    # SQLite only checks foreign keys on connections that ask for it, without
+    # this a like of a missing event would insert instead of raising IntegrityError
+    engine = getattr(engine, "sync_engine", engine)
+    if engine.dialect.name != "sqlite":
+        return
 
+    @event.listens_for(engine, "connect")
+    def set_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
+
+# Sync engine is kept for schema management and scripts only
 engine = create_engine(URL_DATABASE)
+enforce_foreign_keys(engine)
 
 sessionLocal = sessionmaker(autoflush=False, autocommit=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_URL_DATABASE, **pool_options(ASYNC_URL_DATABASE))
+instrument_engine(async_engine)
+enforce_foreign_keys(async_engine)
+
+replica_engines = []
+for number, url in enumerate(REPLICA_URL_DATABASES):
+    replica_engines.append(create_async_engine(to_async_url(url), **pool_options(url)))
+    instrument_engine(replica_engines[-1], f"replica{number}")
+    enforce_foreign_keys(replica_engines[-1])
+
+
+async def warm_up(engine, connections: int = POOL_WARM):
+    # Opens connections before traffic arrives and returns them to the pool
+    # idle, so the first requests skip the connect and login round trips.
+    # NullPool (SQLite) keeps nothing, there is nothing to warm
+    size = getattr(engine.pool, "size", None)
+    if size is None:
+        return
+
+    opened = await asyncio.gather(*(engine.connect().start() for _ in range(min(connections, size()))))
+
+    for connection in opened:
+        await connection.close()
+
+_replicas = itertools.cycle(replica_engines)
+
+# Signed, short-lived marker of a user's last write; it travels with the
+# client, so whichever worker serves the next read sends it to the primary
+STICKY_COOKIE = "primary_until"
+
+
+class RoutingSession(Session):
+    # Sessions opened with info={"replica": True} send plain SELECTs to one
+    # replica (kept for the whole session); flushes, DML and every statement of
+    # other sessions go to the primary
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        if self._flushing or getattr(clause, "is_dml", False):
+            self.info["wrote"] = True
+
+        elif self.info.get("replica") and replica_engines and getattr(clause, "is_select", False):
+            if "replica_engine" not in self.info:
+                self.info["replica_engine"] = next(_replicas)
+            return self.info["replica_engine"].sync_engine
+
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def mark_sticky_user(session):
+    wrote = session.info.pop("wrote", False)
+    response = session.info.get("response")
+
+    if wrote and response is not None and session.info.get("user_id") is not None:
+        token = jwt.encode({"id": session.info["user_id"], "exp": time.time() + REPLICA_STICKY_SECONDS},
+            SECRET_KEY, algorithm=ALGORITHM)
+        response.set_cookie(STICKY_COOKIE, token, max_age=math.ceil(REPLICA_STICKY_SECONDS),
+            httponly=True, samesite="lax")
+
+
+def is_sticky(request: Request, user_id: int) -> bool:
+    token = request.cookies.get(STICKY_COOKIE)
+    if not token:
+        return False
+
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("id") == user_id
+    except JWTError:
+        return False
+
+
+asyncSessionLocal = async_sessionmaker(async_engine, sync_session_class=RoutingSession,
+    autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
+
+
+def bearer_user_id(request: Request) -> int | None:
+    # Only used to pick a database, authentication itself happens in routers.auth
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("id")
+    except JWTError:
+        return None
+
+
+async def get_db(request: Request, response: Response):
+    user_id = bearer_user_id(request) if replica_engines else None
+
+    # Commits that wrote set the sticky cookie on this response
+    async with asyncSessionLocal(info={"user_id": user_id, "response": response}) as db:
+        yield db
+
+
+async def get_read_db(request: Request):
+    user_id = bearer_user_id(request) if replica_engines else None
+    replica = user_id is None or not is_sticky(request, user_id)
+
+    async with asyncSessionLocal(info={"user_id": user_id, "replica": replica}) as db:
+        # The response cache checks whether what it is about to store came from a replica
+        request.state.db_info = db.info
+        yield db
+
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
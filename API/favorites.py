@@ -0,0 +1,108 @@
+import bisect
+from array import array
+
+from sqlalchemy import select
+
+from cache import TTLCache
+from models import EventLike, VenueLike
+from settings import FAVORITES_CACHE_USERS as MAX_CACHED_USERS, FAVORITES_CACHE_TTL as CACHE_TTL
+
+
+class LikedIds:
+    # Sorted array of 32 bit ids, a few bytes per like instead of a set entry;
+    # membership is a binary search
+    __slots__ = ("ids",)
+
+    def __init__(self, ids=()):
+        self.ids = array("i", sorted(ids))
+
+    def __contains__(self, item_id: int) -> bool:
+        position = bisect.bisect_left(self.ids, item_id)
+
+        return position < len(self.ids) and self.ids[position] == item_id
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, item_id: int):
+        if item_id not in self:
+            bisect.insort(self.ids, item_id)
+
+    def discard(self, item_id: int):
+        position = bisect.bisect_left(self.ids, item_id)
+
+        if position < len(self.ids) and self.ids[position] == item_id:
+            del self.ids[position]
+
+    def annotate(self, page: dict) -> dict:
+        # Flags every item of a listing page in one pass
+        for item in page["items"]:
+            item["liked_by_me"] = item["id"] in self
+
+        return page
+
+
+class FavoritesCache:
+    # Per-user liked target ids, LRU and TTL bounded. Like/unlike handlers keep
+    # cached entries in step, so "liked by me" checks are one lookup
+    def __init__(self, like_model, target_column, max_users: int = MAX_CACHED_USERS,
+            ttl: float = CACHE_TTL):
+        self.like_model = like_model
+        self.target_column = target_column
+        self.users = TTLCache(maxsize=max_users, ttl=ttl)
+        # Loads in flight per user, and users whose likes changed during one
+        self.loading = {}
+        self.changed = set()
+
+    async def get(self, db, user_id: int) -> LikedIds:
+        ids = self.users.get(user_id)
+        if ids is not None:
+            return ids
+
+        self.loading[user_id] = self.loading.get(user_id, 0) + 1
+        try:
+            ids = LikedIds((await db.execute(select(self.target_column).where(
+                self.like_model.owner_id == user_id))).scalars())
+        finally:
+            self.loading[user_id] -= 1
+            if not self.loading[user_id]:
+                del self.loading[user_id]
+
+        # A like or unlike committed while the SELECT ran may be missing from
+        # it; serve the result once, the next call loads again
+        if user_id in self.changed:
+            if user_id not in self.loading:
+                self.changed.discard(user_id)
+            return ids
+
+        self.users.set(user_id, ids)
+
+        return ids
+
+    def _changed(self, user_id: int):
+        if user_id in self.loading:
+            self.changed.add(user_id)
+
+    def add(self, user_id: int, item_id: int):
+        self._changed(user_id)
+
+        ids = self.users.get(user_id)
+        if ids is not None:
+            ids.add(item_id)
+
+    def discard(self, user_id: int, item_id: int):
+        self._changed(user_id)
+
+        ids = self.users.get(user_id)
+        if ids is not None:
+            ids.discard(item_id)
+
+    def invalidate(self, user_id: int):
+        self.users.pop(user_id)
+
+
+favorite_events = FavoritesCache(EventLike, EventLike.event)
+favorite_venues = FavoritesCache(VenueLike, VenueLike.venue)
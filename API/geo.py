@@ -0,0 +1,57 @@
+import math
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = EARTH_RADIUS_KM * math.pi / 180
+
+# The globe is split into a fixed grid of CELL_SIZE degree cells, numbered
+# row by row, so all cells of one row inside a bounding box form a single
+# contiguous range of geo_cell values
+CELL_SIZE = 0.05
+CELLS_PER_ROW = round(360 / CELL_SIZE)
+ROWS = round(180 / CELL_SIZE)
+
+
+def _row(lat: float) -> int:
+    return min(int((lat + 90) // CELL_SIZE), ROWS - 1)
+
+
+def _col(lng: float) -> int:
+    return min(int((lng + 180) // CELL_SIZE), CELLS_PER_ROW - 1)
+
+
+def geo_cell(lat: float, lng: float) -> int:
+    return _row(lat) * CELLS_PER_ROW + _col(lng)
+
+
+def bounding_box(lat: float, lng: float, radius_km: float):
+    d_lat = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = max(lat - d_lat, -90.0), min(lat + d_lat, 90.0)
+
+    # Widest longitude span of the circle on the sphere, which haversine_km
+    # measures; a box reaching a pole spans every longitude
+    ratio = math.sin(radius_km / EARTH_RADIUS_KM) / max(math.cos(math.radians(lat)), 0.0)
+    if min_lat <= -90.0 or max_lat >= 90.0 or ratio >= 1:
+        return min_lat, max_lat, -180.0, 180.0
+
+    d_lng = math.degrees(math.asin(ratio))
+
+    # Boxes crossing the antimeridian are clamped rather than wrapped
+    return min_lat, max_lat, max(lng - d_lng, -180.0), min(lng + d_lng, 180.0)
+
+
+def cell_ranges(min_lat: float, max_lat: float, min_lng: float, max_lng: float):
+    first_col, last_col = _col(min_lng), _col(max_lng)
+
+    return [(row * CELLS_PER_ROW + first_col, row * CELLS_PER_ROW + last_col)
+        for row in range(_row(min_lat), _row(max_lat) + 1)]
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
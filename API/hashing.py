@@ -0,0 +1,31 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from settings import BCRYPT_ROUNDS, HASH_CONCURRENCY
+
+
+# Hashes made with other rounds are reported by verify_and_update() so they
+# are upgraded on the next successful login
+bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto',
+    bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL, so a small thread pool keeps it off the event loop;
+# the semaphore caps in-flight hashes and makes the rest wait without blocking
+_executor = ThreadPoolExecutor(max_workers=HASH_CONCURRENCY, thread_name_prefix="bcrypt")
+_slots = asyncio.Semaphore(HASH_CONCURRENCY)
+
+
+async def _run(func, *args):
+    async with _slots:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(bcrypt_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    # Returns (valid, new_hash); new_hash is set when the stored hash should be replaced
+    return await _run(bcrypt_context.verify_and_update, password, hashed_password)
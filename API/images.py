@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import aiofiles
+import aiofiles.os
+from PIL import Image, UnidentifiedImageError
+
+from settings import MEDIA_ROOT, MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, IMAGE_WORKERS
+
+
+logger = logging.getLogger(__name__)
+
+# Pillow refuses to open anything over twice this, renders are bounded too
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Longest side in pixels; every variant is re-encoded as WebP
+VARIANTS = {
+    "thumb": 160,
+    "medium": 800,
+}
+WEBP_QUALITY = 80
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Pillow releases the GIL while decoding, resizing and encoding
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="images")
+_pending = {}
+_mime_types = {}
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def is_digest(value: str) -> bool:
+    return bool(DIGEST_RE.match(value))
+
+
+def original_path(digest: str) -> Path:
+    return MEDIA_ROOT / "originals" / digest[:2] / digest
+
+
+def variant_path(digest: str, variant: str) -> Path:
+    return MEDIA_ROOT / variant / digest[:2] / f"{digest}.webp"
+
+
+def _inspect(path: Path) -> str:
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            if image.width * image.height > MAX_IMAGE_PIXELS:
+                raise ImageTooLarge()
+            image.verify()
+
+    except Image.DecompressionBombError:
+        raise ImageTooLarge()
+
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise InvalidImage()
+
+    if image_format not in MIME_TYPES:
+        raise InvalidImage()
+
+    return MIME_TYPES[image_format]
+
+
+def _render(digest: str, variant: str):
+    target = variant_path(digest, variant)
+    if target.exists():
+        return
+
+    with Image.open(original_path(digest)) as image:
+        image.thumbnail((VARIANTS[variant], VARIANTS[variant]))
+
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temporary = target.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        image.save(temporary, "WEBP", quality=WEBP_QUALITY)
+        os.replace(temporary, target)
+
+
+async def run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def store(chunks) -> tuple[str, str]:
+    # Streams the body to disk while hashing it; identical uploads share one file
+    tmp_dir = MEDIA_ROOT / "tmp"
+    await aiofiles.os.makedirs(tmp_dir, exist_ok=True)
+    temporary = tmp_dir / uuid.uuid4().hex
+
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(temporary, "wb") as file:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise ImageTooLarge()
+
+                digest.update(chunk)
+                await file.write(chunk)
+
+        content_type = await run(_inspect, temporary)
+
+        target = original_path(digest.hexdigest())
+        if await aiofiles.os.path.exists(target):
+            await aiofiles.os.remove(temporary)
+        else:
+            await aiofiles.os.makedirs(target.parent, exist_ok=True)
+            await aiofiles.os.replace(temporary, target)
+
+    except BaseException:
+        if await aiofiles.os.path.exists(temporary):
+            await aiofiles.os.remove(temporary)
+        raise
+
+    _mime_types[digest.hexdigest()] = content_type
+
+    return digest.hexdigest(), content_type
+
+
+def render_variants(digest: str):
+    # Schedules variant generation off the request path, at most once per image
+    for variant in VARIANTS:
+        ensure_variant(digest, variant)
+
+
+def ensure_variant(digest: str, variant: str) -> asyncio.Future:
+    key = (digest, variant)
+
+    if key not in _pending:
+        future = asyncio.ensure_future(run(_render, digest, variant))
+        future.add_done_callback(lambda done: _variant_done(key, done))
+        _pending[key] = future
+
+    return _pending[key]
+
+
+def _variant_done(key: tuple[str, str], future: asyncio.Future):
+    _pending.pop(key, None)
+
+    # Uploads schedule renders without awaiting them, failures only show up here
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Failed to render %s variant of %s", key[1], key[0],
+            exc_info=future.exception())
+
+
+async def mime_type(digest: str) -> str:
+    # Originals are immutable, so their type is looked up once per process
+    if digest not in _mime_types:
+        _mime_types[digest] = await run(_inspect, original_path(digest))
+
+    return _mime_types[digest]
@@ -1,16 +1,99 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import httpx
 from fastapi import FastAPI, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
 
 from fastapi.middleware.cors import CORSMiddleware
 
 from typing import Annotated
 
-from models import Base
-from database import engine, sessionLocal
-from routers import auth, venues, events
+import settings
+from schemas import UserInfo
+from database import async_engine, replica_engines, asyncSessionLocal, db_dependency, warm_up
+from routers import auth, venues, events, search, bulk, live, images, metrics
+
+import counters
+import migrate
+import trending
+import recommendations
+from search import search_index, run_refresher
+from timeline import event_timeline, run_refresher as run_timeline_refresher
+from metrics import MetricsMiddleware
+
+
+logger = logging.getLogger(__name__)
+
+
+async def load_search():
+    async with asyncSessionLocal() as db:
+        await search_index.rebuild(db)
+
+
+async def load_timeline():
+    async with asyncSessionLocal() as db:
+        await event_timeline.rebuild(db)
+
+
+async def load_recommendations():
+    async with asyncSessionLocal() as db:
+        await recommendations.recommender.rebuild(db)
+
+
+async def prime_caches(app: FastAPI):
+    # Goes through the app itself so exactly what clients will ask for is cached.
+    # A failing path is logged, a cold cache is no reason to keep the worker down
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+        for path in settings.CACHE_WARM_PATHS:
+            try:
+                response = await client.get(path)
+            except Exception:
+                logger.exception("Failed to warm %s", path)
+                continue
 
+            if response.status_code != status.HTTP_200_OK:
+                logger.warning("Warming %s returned %s", path, response.status_code)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.monotonic()
+
+    await migrate.check(async_engine)
+    await asyncio.gather(*(warm_up(db_engine) for db_engine in [async_engine, *replica_engines]))
+
+    # Independent in-memory indexes, each on its own connection
+    await asyncio.gather(load_search(), load_timeline(), trending.load_all(), load_recommendations())
+    await prime_caches(app)
+
+    logger.info("Ready in %.2fs", time.monotonic() - started)
+
+    tasks = [
+        asyncio.create_task(counters.run_flusher()),
+        asyncio.create_task(run_refresher()),
+        asyncio.create_task(run_timeline_refresher()),
+        asyncio.create_task(trending.run_refresher()),
+        asyncio.create_task(recommendations.run_refresher()),
+    ]
+
+    yield
+
+    # Waits for the cancellations so no task is left holding a connection
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    await counters.flush_all()
+    await trending.persist_all()
+    await asyncio.gather(*(db_engine.dispose() for db_engine in [async_engine, *replica_engines]))
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,27 +101,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(venues.router)
 app.include_router(events.router)
-
-Base.metadata.create_all(bind=engine)
-
-
-def get_db():
-    db = sessionLocal()
-    
-    try:
-        yield db
-    finally:
-        db.close()    
+app.include_router(search.router)
+app.include_router(bulk.router)
+app.include_router(live.router)
+app.include_router(images.router)
+app.include_router(metrics.router)
 
 
-db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[dict, Depends (auth.get_current_user)]
+user_dependency = Annotated[UserInfo, Depends (auth.get_current_user)]
 
-@app.post("/user", status_code=status.HTTP_200_OK)
+@app.post("/user", status_code=status.HTTP_200_OK, response_model=UserInfo)
 async def user(user: user_dependency, db: db_dependency):
     if user is None:
         raise HTTPException(status_code=401, detail='Authentication Failed')
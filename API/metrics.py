@@ -0,0 +1,190 @@
+import bisect
+import contextvars
+import logging
+import time
+from collections import defaultdict
+
+from sqlalchemy import event
+
+from settings import QUERY_WARN_THRESHOLD
+
+
+logger = logging.getLogger(__name__)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    # Cumulative buckets are only computed when rendered, observe() bumps one slot
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self.series = defaultdict(lambda: [[0] * (len(buckets) + 1), 0.0])
+
+    def observe(self, value: float, *label_values):
+        series = self.series[label_values]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        for label_values, (counts, total) in sorted(self.series.items()):
+            labels = [f'{name}="{value}"' for name, value in zip(self.labels, label_values)]
+            cumulative = 0
+
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = ",".join([*labels, f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+
+            suffix = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = defaultdict(int)
+
+    def inc(self, *label_values, amount: int = 1):
+        self.series[label_values] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+
+        for label_values, value in sorted(self.series.items()):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+
+        return lines
+
+
+request_duration = Histogram("http_request_duration_seconds",
+    "Request latency by route", LATENCY_BUCKETS, ("method", "route"))
+requests_total = Counter("http_requests_total",
+    "Requests by route and status", ("method", "route", "status"))
+request_queries = Histogram("db_queries_per_request",
+    "SQL statements issued per request", QUERY_BUCKETS, ("method", "route"))
+request_db_time = Histogram("db_time_per_request_seconds",
+    "Time spent executing SQL per request", LATENCY_BUCKETS, ("method", "route"))
+pool_wait = Histogram("db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection", WAIT_BUCKETS, ("pool",))
+
+REGISTRY = (request_duration, requests_total, request_queries, request_db_time, pool_wait)
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# Per-request SQL accounting
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Set by the middleware; SQLAlchemy runs cursor events in a greenlet that
+# shares the calling task's context, so the hooks see the current request
+request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = request_stats.get()
+
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+def instrument_engine(engine, name: str = "primary"):
+    # Takes the sync engine behind an AsyncEngine as well
+    engine = getattr(engine, "sync_engine", engine)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    # The pool has no "before checkout" event, so the blocking getter is timed directly
+    pool = engine.pool
+    do_get = pool._do_get
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            pool_wait.observe(time.perf_counter() - started, name)
+
+    pool._do_get = timed_do_get
+
+
+# ASGI middleware
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware, which would run the endpoint in
+    # another task and hide the request's context from the SQL hooks
+    def __init__(self, app):
+        self.app = app
+        self.routes = {}
+
+    def route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+
+        if endpoint not in self.routes:
+            self.routes.update((route.endpoint, route.path)
+                for route in scope["app"].router.routes if hasattr(route, "endpoint"))
+
+        return self.routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+
+        finally:
+            request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+
+            method, route = scope["method"], self.route_path(scope)
+            request_duration.observe(elapsed, method, route)
+            requests_total.inc(method, route, str(status_code))
+            request_queries.observe(stats.queries, method, route)
+            request_db_time.observe(stats.db_time, method, route)
+
+            if QUERY_WARN_THRESHOLD and stats.queries > QUERY_WARN_THRESHOLD:
+                logger.warning("%s %s issued %d queries (%.1f ms in the database)",
+                    method, route, stats.queries, stats.db_time * 1000)
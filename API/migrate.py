@@ -0,0 +1,167 @@
+import logging
+
+from sqlalchemy import MetaData, select, delete, insert, inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from database import engine
+from geo import geo_cell
+from models import Base, SchemaVersion, Venue
+from settings import SCHEMA_AUTO_CREATE
+
+
+logger = logging.getLogger(__name__)
+
+# Bumped with every model change that touches existing tables, together with
+# the MIGRATIONS step that brings the previous version up to it. New tables
+# need no step, create_all adds them. Version 0 is the schema from before
+# versioning, a database with tables but no schema_version row
+SCHEMA_VERSION = 1
+
+# Tables that only exist once the app has created its schema
+APP_TABLES = ("users", "venues", "events")
+
+
+def _backfill_geo_cells(connection):
+    rows = connection.execute(text("SELECT id, lat, lng FROM venues")).all()
+
+    if rows:
+        connection.execute(text("UPDATE venues SET geo_cell = :cell WHERE id = :venue_id"),
+            [{"cell": geo_cell(lat, lng), "venue_id": venue_id} for venue_id, lat, lng in rows])
+
+
+def _rebuild_sqlite_venues(connection):
+    # SQLite cannot change a column type: copy into a table created from the
+    # model, then swap it in under the old name (child tables refer to it by name)
+    old_columns = {column["name"] for column in inspect(connection).get_columns("venues")}
+
+    new_table = Venue.__table__.to_metadata(MetaData(), name="venues_new")
+    new_table.indexes.clear()
+    new_table.create(connection)
+
+    copied = [column.name for column in Venue.__table__.columns
+        if column.name in old_columns and column.name not in ("lat", "lng")]
+    names = ", ".join(copied)
+
+    connection.execute(text(f"INSERT INTO venues_new ({names}, lat, lng, geo_cell, created_at) "
+        f"SELECT {names}, CAST(lat AS REAL), CAST(lng AS REAL), 0, CURRENT_TIMESTAMP FROM venues"))
+    connection.execute(text("DROP TABLE venues"))
+    connection.execute(text("ALTER TABLE venues_new RENAME TO venues"))
+
+    # Foreign keys are off for the run (see __main__), check nothing dangles
+    if connection.exec_driver_sql("PRAGMA foreign_key_check").first() is not None:
+        raise RuntimeError("Foreign key violations after rebuilding venues")
+
+
+def _dedupe_likes(connection, table: str, target: str, counted: str):
+    # Duplicates predate the unique index; counters are recomputed after dropping them
+    connection.execute(text(f"DELETE FROM {table} WHERE id NOT IN (SELECT keep FROM "
+        f"(SELECT MIN(id) AS keep FROM {table} GROUP BY owner_id, {target}) AS keepers)"))
+    connection.execute(text(f"UPDATE {counted} SET num_likes = "
+        f"(SELECT COUNT(*) FROM {table} WHERE {table}.{target} = {counted}.id)"))
+    connection.execute(text(f"CREATE UNIQUE INDEX uq_{table}_owner_id_{target} ON {table} (owner_id, {target})"))
+
+
+def baseline_to_1(connection):
+    # Numeric venue coordinates with their grid cell, venues.created_at,
+    # unique likes and the composite indexes of the listing queries. MySQL
+    # commits each DDL statement, a run that fails halfway needs a look by hand
+    if connection.dialect.name == "sqlite":
+        _rebuild_sqlite_venues(connection)
+    else:
+        connection.execute(text("ALTER TABLE venues MODIFY lat DOUBLE NOT NULL, MODIFY lng DOUBLE NOT NULL, "
+            "ADD COLUMN geo_cell INTEGER NOT NULL DEFAULT 0, "
+            "ADD COLUMN created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"))
+
+    _backfill_geo_cells(connection)
+
+    _dedupe_likes(connection, "event_likes", "event", "events")
+    _dedupe_likes(connection, "venue_likes", "venue", "venues")
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+MIGRATIONS = {1: baseline_to_1}
+
+
+def has_tables(connection) -> bool:
+    inspector = inspect(connection)
+
+    return any(inspector.has_table(table) for table in APP_TABLES)
+
+
+def stored_version(connection) -> int | None:
+    # One single-row read instead of reflecting every table; None when no
+    # version is recorded, 0 when the tables predate versioning
+    try:
+        version = connection.scalar(select(SchemaVersion.version))
+    except DBAPIError:
+        connection.rollback()
+        version = None
+
+    if version is None and has_tables(connection):
+        return 0
+
+    return version
+
+
+def upgrade(connection, version: int | None):
+    # Runs on a sync connection inside a transaction; version None is an empty database
+    if version is not None:
+        for step in range(version + 1, SCHEMA_VERSION + 1):
+            logger.info("Migrating database schema to version %s", step)
+            MIGRATIONS[step](connection)
+
+    Base.metadata.create_all(bind=connection)
+
+    connection.execute(delete(SchemaVersion))
+    connection.execute(insert(SchemaVersion).values(version=SCHEMA_VERSION))
+
+
+async def check(async_engine, auto_create: bool = SCHEMA_AUTO_CREATE):
+    async with async_engine.connect() as connection:
+        version = await connection.run_sync(stored_version)
+
+    if version == SCHEMA_VERSION:
+        return
+
+    # Only an empty database is set up from a worker, migrations run once per deploy
+    if version is None and auto_create:
+        logger.info("Empty database, creating tables")
+        async with async_engine.begin() as connection:
+            await connection.run_sync(upgrade, None)
+        return
+
+    found = "no tables" if version is None else f"version {version}"
+    raise RuntimeError(f"Database schema is at {found}, this build expects version "
+        f"{SCHEMA_VERSION}; run `python migrate.py` first")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    with engine.connect() as connection:
+        version = stored_version(connection)
+
+    if version is not None and version > SCHEMA_VERSION:
+        raise SystemExit(f"Database schema is at version {version}, newer than this build ({SCHEMA_VERSION})")
+
+    with engine.connect() as connection:
+        # Dropping the old venues table on SQLite would fail its child tables'
+        # foreign keys; the pragma is ignored inside a transaction, so it is
+        # set before begin and restored after the commit
+        sqlite = connection.dialect.name == "sqlite"
+
+        if sqlite:
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            connection.commit()
+
+        upgrade(connection, version)
+        connection.commit()
+
+        if sqlite:
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+            connection.commit()
+
+    logger.info("Database schema at version %s", SCHEMA_VERSION)
@@ -1,16 +1,23 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Enum, ForeignKey, Time
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Enum, ForeignKey, Time, Index, Double, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.sqltypes import TIMESTAMP
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.sql.expression import text
+from sqlalchemy.sql.functions import func
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.event import listens_for
 
 from datetime import time
 
-from fastapi_storages import FileSystemStorage
-from fastapi_storages.integrations.sqlalchemy import FileType
-
 
 from database import Base
+from geo import geo_cell
+
+
+# SQLite's CURRENT_TIMESTAMP has no fractional seconds, bound values are stored
+# the same way so keyset comparisons on created_at line up
+CreatedAt = TIMESTAMP(timezone=True).with_variant(sqlite.DATETIME(
+    storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"), "sqlite")
 
 
 class User(Base):
@@ -41,6 +48,11 @@ class Post(Base):
 
 class Venue(Base):
     __tablename__ = "venues"
+    __table_args__ = (
+        Index("ix_venues_num_likes_id", "num_likes", "id"),
+        Index("ix_venues_venue_type_num_likes_id", "venue_type", "num_likes", "id"),
+        Index("ix_venues_geo_cell_lat_lng", "geo_cell", "lat", "lng"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     
@@ -50,8 +62,9 @@ class Venue(Base):
     venue_type = Column(Enum("museum", "theatre", "library", "cinema",
         "comedy_club","monument","cultural_space", name="venue_type" ))
 
-    lat = Column(String(257), nullable=False)
-    lng = Column(String(257), nullable=False)
+    lat = Column(Double, nullable=False)
+    lng = Column(Double, nullable=False)
+    geo_cell = Column(Integer, nullable=False)
 
     num_likes = Column(Integer, server_default = text("0"), nullable = False, default=0)
     comments = relationship("VenueComment", backref = "venue_comments") 
@@ -63,9 +76,23 @@ class Venue(Base):
     work_hours_open = Column(Time, default=time(10, 0))
     work_hours_close = Column(Time, default=time(18, 0))
 
+    created_at = Column(CreatedAt, nullable=False, server_default=func.now())
+
+
+@listens_for(Venue, "before_insert")
+@listens_for(Venue, "before_update")
+def set_venue_geo_cell(mapper, connection, target):
+    target.geo_cell = geo_cell(target.lat, target.lng)
+
 
 class Event(Base):
     __tablename__ = "events"
+    __table_args__ = (
+        Index("ix_events_num_likes_id", "num_likes", "id"),
+        Index("ix_events_event_type_num_likes_id", "event_type", "num_likes", "id"),
+        Index("ix_events_venue_id_num_likes_id", "venue_id", "num_likes", "id"),
+        Index("ix_events_date_start", "date", "start"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
 
@@ -85,7 +112,7 @@ class Event(Base):
 
     poster_image_link = Column(String(511), nullable=True)
     
-    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    created_at = Column(CreatedAt, nullable=False, server_default=func.now())
     
     num_likes = Column(Integer, server_default = text("0"), nullable = False)
     comments = relationship("EventComment", backref = "event_comments")        
@@ -113,17 +140,23 @@ class Comment:
 
     @declared_attr
     def created_at(cls):
-        return Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+        return Column(CreatedAt, nullable=False, server_default=func.now())
 
 
 class EventComment(Base, Comment):
     __tablename__ = "event_comments"
+    __table_args__ = (
+        Index("ix_event_comments_event_created_at_id", "event", "created_at", "id"),
+    )
 
     event = Column(Integer, ForeignKey("events.id"), nullable=False)
 
 
 class VenueComment(Base, Comment):
     __tablename__ = "venue_comments"
+    __table_args__ = (
+        Index("ix_venue_comments_venue_created_at_id", "venue", "created_at", "id"),
+    )
     
     venue = Column(Integer, ForeignKey("venues.id"), nullable = False)
 
@@ -143,17 +176,42 @@ class Like:
 
     @declared_attr
     def created_at(cls):
-        return Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+        return Column(CreatedAt, nullable=False, server_default=func.now())
 
 
 class EventLike(Base, Like):
     __tablename__ = "event_likes"
+    __table_args__ = (
+        UniqueConstraint("owner_id", "event", name="uq_event_likes_owner_id_event"),
+        Index("ix_event_likes_owner_id_id", "owner_id", "id"),
+    )
 
     event = Column(Integer, ForeignKey("events.id"), nullable=False)
 
 
 class VenueLike(Base, Like):
     __tablename__ = "venue_likes"
+    __table_args__ = (
+        UniqueConstraint("owner_id", "venue", name="uq_venue_likes_owner_id_venue"),
+    )
 
     venue = Column(Integer, ForeignKey("venues.id"), nullable=False)
 
+
+class TrendingScore(Base):
+    __tablename__ = "trending_scores"
+
+    kind = Column(String(15), primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+
+    # Decayed like count as of updated_at; the snapshot covers likes up to like_id
+    score = Column(Double, nullable=False)
+    like_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    # Single row, compared against migrate.SCHEMA_VERSION at startup
+    version = Column(Integer, primary_key=True)
@@ -0,0 +1,102 @@
+import base64
+import binascii
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, select, func
+from sqlalchemy.orm import selectinload
+from starlette import status
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def _encode(*parts) -> str:
+    raw = ":".join(str(part) for part in parts).encode()
+
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(cursor: str, count: int) -> list[str]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    parts = base64.urlsafe_b64decode(padded).decode().rsplit(":", count - 1)
+
+    if len(parts) != count:
+        raise ValueError("Wrong number of cursor parts")
+
+    return parts
+
+
+def encode_cursor(num_likes: int, item_id: int) -> str:
+    return _encode(num_likes, item_id)
+
+
+def decode_cursor(cursor: str) -> tuple[int, int]:
+    try:
+        num_likes, item_id = _decode(cursor, 2)
+
+        return int(num_likes), int(item_id)
+
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor")
+
+
+def encode_time_cursor(created_at: datetime, item_id: int) -> str:
+    return _encode(created_at.isoformat(), item_id)
+
+
+def decode_time_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, item_id = _decode(cursor, 2)
+
+        return datetime.fromisoformat(created_at), int(item_id)
+
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor")
+
+
+async def keyset_page(db, stmt, model, cursor: str | None, limit: int):
+    # Most liked first, id breaks ties so the order is total and stable
+    if cursor:
+        num_likes, item_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            model.num_likes < num_likes,
+            and_(model.num_likes == num_likes, model.id < item_id),
+        ))
+
+    stmt = stmt.order_by(model.num_likes.desc(), model.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).scalars().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].num_likes, rows[-1].id)
+
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+async def comment_page(db, model, target_column, target_id: int, cursor: str | None, limit: int):
+    # Newest first; (target, created_at, id) index serves both the page and the count
+    stmt = select(model).options(selectinload(model.owner)).where(target_column == target_id)
+
+    if cursor:
+        created_at, item_id = decode_time_cursor(cursor)
+        stmt = stmt.where(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < item_id),
+        ))
+
+    stmt = stmt.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).scalars().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_time_cursor(rows[-1].created_at, rows[-1].id)
+
+    count = await db.scalar(select(func.count()).select_from(model).where(target_column == target_id))
+
+    return {"items": rows, "next_cursor": next_cursor, "count": count}
@@ -0,0 +1,55 @@
+from fastapi import HTTPException
+from sqlalchemy.orm import load_only, selectinload, joinedload
+from starlette import status
+
+
+class Projection:
+    # Maps ?fields= to a column projection and ?include= to relationship loaders,
+    # so a read costs one query plus one per included relationship at most
+    def __init__(self, model, schema, relations: dict | None = None, always: tuple = ("id",)):
+        self.model = model
+        self.columns = tuple(name for name in schema.model_fields if hasattr(model, name))
+        self.relations = relations or {}
+        self.always = always
+
+    def parse(self, fields: str | None, include: str | None):
+        if fields is None and include is None:
+            return None
+
+        columns = self._split(fields, self.columns, "field") if fields is not None else list(self.columns)
+        includes = self._split(include, self.relations, "include") if include is not None else []
+
+        return columns, includes
+
+    def options(self, columns, includes, many: bool = True) -> list:
+        loaded = set(columns) | set(self.always)
+        for name in includes:
+            loaded.add(self.relations[name])
+
+        options = [load_only(*(getattr(self.model, name) for name in loaded))]
+
+        # selectinload batches related rows for lists, a join is cheaper for one row
+        strategy = selectinload if many else joinedload
+        options += [strategy(getattr(self.model, name)) for name in includes]
+
+        return options
+
+    def dump(self, obj, columns, includes) -> dict:
+        # The id is always emitted, sparse rows still have to be identifiable
+        row = {name: getattr(obj, name) for name in dict.fromkeys(("id", *columns))}
+
+        for name in includes:
+            row[name] = getattr(obj, name)
+
+        return row
+
+    @staticmethod
+    def _split(value: str, allowed, kind: str) -> list[str]:
+        names = [name.strip() for name in value.split(",") if name.strip()]
+        unknown = [name for name in names if name not in allowed]
+
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown {kind}: {', '.join(unknown)}")
+
+        return list(dict.fromkeys(names))
@@ -0,0 +1,247 @@
+import asyncio
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+
+from cache import TTLCache
+from database import asyncSessionLocal
+from models import EventLike, VenueLike
+from settings import (RECOMMEND_NEIGHBORS as NEIGHBORS, RECOMMEND_TOP_N as TOP_N,
+    RECOMMEND_CACHE_USERS as CACHE_USERS, RECOMMEND_CACHE_TTL as CACHE_TTL,
+    RECOMMEND_REFRESH_INTERVAL as REFRESH_INTERVAL, RECOMMEND_REBUILD_INTERVAL as REBUILD_INTERVAL)
+
+
+logger = logging.getLogger(__name__)
+
+# Matrix work runs off the event loop; numpy and scipy release the GIL for most of it
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recommendations")
+
+
+class CoLikes:
+    # Users x items like matrix over events and venues (venue columns follow the
+    # event columns), the item x item co-occurrence counts, and their cosine
+    # similarities pruned to the strongest NEIGHBORS per item
+    def __init__(self, user_ids, event_ids, venue_ids, likes, cooccurrence):
+        self.user_ids = user_ids
+        self.event_ids = event_ids
+        self.venue_ids = venue_ids
+        self.likes = likes
+        self.cooccurrence = cooccurrence
+        self.similarity = cosine_neighbors(cooccurrence, NEIGHBORS)
+
+
+def lookup(ids, values):
+    positions = np.searchsorted(ids, values)
+    if positions.size and (positions.max() >= ids.size or (ids[positions] != values).any()):
+        return None
+
+    return positions
+
+
+def like_pairs(rows: list) -> np.ndarray:
+    # (like id, user id, item id) rows to an (n, 2) array of (user_id, item_id)
+    flat = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows))
+
+    return flat.reshape(-1, 3)[:, 1:]
+
+
+def item_columns(event_ids, venue_ids, events, venues):
+    return np.concatenate([np.searchsorted(event_ids, events),
+        np.searchsorted(venue_ids, venues) + len(event_ids)])
+
+
+def remap(matrix, rows, columns, shape):
+    # Moves every entry to its new row and column, for matrices grown by new ids
+    matrix = matrix.tocoo()
+
+    return sparse.csr_matrix((matrix.data, (rows[matrix.row], columns[matrix.col])), shape=shape)
+
+
+def like_matrix(rows, columns, shape):
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    return matrix
+
+
+def cosine_neighbors(cooccurrence, neighbors: int):
+    counts = cooccurrence.diagonal().astype(np.float32)
+
+    similarity = cooccurrence.astype(np.float32).tocoo()
+    keep = similarity.row != similarity.col
+    rows, columns = similarity.row[keep], similarity.col[keep]
+    values = similarity.data[keep] / np.sqrt(counts[rows] * counts[columns])
+
+    similarity = sparse.csr_matrix((values, (rows, columns)), shape=cooccurrence.shape)
+
+    # Only items with more than `neighbors` entries need trimming
+    lengths = np.diff(similarity.indptr)
+    for row in np.flatnonzero(lengths > neighbors):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        weakest = np.argpartition(similarity.data[start:end], -neighbors)[:-neighbors]
+        similarity.data[start + weakest] = 0
+
+    similarity.eliminate_zeros()
+
+    return similarity
+
+
+def build(event_rows: list, venue_rows: list) -> CoLikes:
+    # Each argument is a list of (like id, user id, item id) rows
+    event_likes, venue_likes = like_pairs(event_rows), like_pairs(venue_rows)
+
+    user_ids = np.unique(np.concatenate([event_likes[:, 0], venue_likes[:, 0]]))
+    event_ids = np.unique(event_likes[:, 1])
+    venue_ids = np.unique(venue_likes[:, 1])
+
+    rows = np.searchsorted(user_ids, np.concatenate([event_likes[:, 0], venue_likes[:, 0]]))
+    columns = item_columns(event_ids, venue_ids, event_likes[:, 1], venue_likes[:, 1])
+
+    likes = like_matrix(rows, columns, (len(user_ids), len(event_ids) + len(venue_ids)))
+
+    return CoLikes(user_ids, event_ids, venue_ids, likes, (likes.T @ likes).tocsr())
+
+
+def extend(model: CoLikes, event_rows: list, venue_rows: list) -> CoLikes:
+    # Adds new likes by updating the co-occurrence counts of the users who
+    # liked something, instead of recomputing likes.T @ likes. New users and
+    # items grow the matrices first; existing entries are only moved
+    event_likes, venue_likes = like_pairs(event_rows), like_pairs(venue_rows)
+    users = np.concatenate([event_likes[:, 0], venue_likes[:, 0]])
+
+    user_ids = np.union1d(model.user_ids, users)
+    event_ids = np.union1d(model.event_ids, event_likes[:, 1])
+    venue_ids = np.union1d(model.venue_ids, venue_likes[:, 1])
+
+    likes, cooccurrence = model.likes, model.cooccurrence
+    items = len(event_ids) + len(venue_ids)
+
+    if (len(user_ids), items) != likes.shape:
+        user_rows = np.searchsorted(user_ids, model.user_ids)
+        columns = item_columns(event_ids, venue_ids, model.event_ids, model.venue_ids)
+
+        likes = remap(likes, user_rows, columns, (len(user_ids), items))
+        cooccurrence = remap(cooccurrence, columns, columns, (items, items))
+
+    rows = np.searchsorted(user_ids, users)
+    columns = item_columns(event_ids, venue_ids, event_likes[:, 1], venue_likes[:, 1])
+
+    added = like_matrix(rows, columns, likes.shape)
+    added = added - added.multiply(likes)
+    added.eliminate_zeros()
+
+    after = likes + added
+    changed = np.unique(added.nonzero()[0])
+
+    before, after_rows = likes[changed], after[changed]
+    cooccurrence = cooccurrence + (after_rows.T @ after_rows - before.T @ before)
+
+    return CoLikes(user_ids, event_ids, venue_ids, after.tocsr(), cooccurrence.tocsr())
+
+
+def recommend(model: CoLikes, user_id: int, count: int) -> list[tuple[int, float]]:
+    row = lookup(model.user_ids, np.array([user_id]))
+    if row is None:
+        return []
+
+    liked = model.likes[row[0]]
+    scores = (liked @ model.similarity).tocsr()
+
+    # Events only, minus the user's own likes
+    columns, values = scores.indices, scores.data
+    keep = (columns < len(model.event_ids)) & ~np.isin(columns, liked.indices)
+    columns, values = columns[keep], values[keep]
+
+    if len(columns) > count:
+        best = np.argpartition(values, -count)[-count:]
+        columns, values = columns[best], values[best]
+
+    order = np.argsort(-values, kind="stable")
+
+    return [(int(model.event_ids[column]), float(value))
+        for column, value in zip(columns[order], values[order])]
+
+
+class Recommender:
+    # Event recommendations from event and venue like co-occurrence. The
+    # matrices are rebuilt in batch and extended as likes arrive; each
+    # user's top N is cached until they like something, the model is rebuilt
+    # or RECOMMEND_CACHE_TTL passes. Other users' likes only reach it then
+    def __init__(self):
+        self.model = None
+        self.last_event_like_id = 0
+        self.last_venue_like_id = 0
+        self.cache = TTLCache(maxsize=CACHE_USERS, ttl=CACHE_TTL)
+
+    async def _likes(self, db, like_model, target_column, after: int):
+        # Raw rows; arrays are built in the executor, not on the event loop
+        rows = (await db.execute(select(like_model.id, like_model.owner_id, target_column)
+            .where(like_model.id > after).order_by(like_model.id))).all()
+
+        return rows, rows[-1][0] if rows else after
+
+    async def rebuild(self, db):
+        event_likes, last_event_like_id = await self._likes(db, EventLike, EventLike.event, 0)
+        venue_likes, last_venue_like_id = await self._likes(db, VenueLike, VenueLike.venue, 0)
+
+        self.model = await asyncio.get_running_loop().run_in_executor(_executor,
+            build, event_likes, venue_likes)
+        self.last_event_like_id, self.last_venue_like_id = last_event_like_id, last_venue_like_id
+        self.cache.clear()
+
+    async def refresh(self, db):
+        if self.model is None:
+            return await self.rebuild(db)
+
+        event_likes, last_event_like_id = await self._likes(db, EventLike, EventLike.event,
+            self.last_event_like_id)
+        venue_likes, last_venue_like_id = await self._likes(db, VenueLike, VenueLike.venue,
+            self.last_venue_like_id)
+
+        if not event_likes and not venue_likes:
+            return
+
+        self.model = await asyncio.get_running_loop().run_in_executor(_executor,
+            extend, self.model, event_likes, venue_likes)
+        self.last_event_like_id, self.last_venue_like_id = last_event_like_id, last_venue_like_id
+
+        for user_id in {row[1] for row in itertools.chain(event_likes, venue_likes)}:
+            self.cache.pop(user_id)
+
+    def recommend(self, user_id: int, limit: int) -> list[tuple[int, float]]:
+        if self.model is None:
+            return []
+
+        ranked = self.cache.get(user_id)
+        if ranked is None:
+            ranked = recommend(self.model, user_id, TOP_N)
+            self.cache.set(user_id, ranked)
+
+        return ranked[:limit]
+
+
+recommender = Recommender()
+
+
+async def run_refresher(interval: float = REFRESH_INTERVAL, rebuild_interval: float = REBUILD_INTERVAL):
+    rebuilt = time.monotonic()
+
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            async with asyncSessionLocal() as db:
+                if time.monotonic() - rebuilt >= rebuild_interval:
+                    await recommender.rebuild(db)
+                    rebuilt = time.monotonic()
+                else:
+                    await recommender.refresh(db)
+
+        except Exception:
+            logger.exception("Failed to refresh recommendations, will retry")
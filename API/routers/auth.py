@@ -5,22 +5,18 @@ from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.event import listens_for
 from starlette import status 
 
-from passlib.context import CryptContext
 from jose import jwt, JWTError
 
-from database import sessionLocal 
+from cache import TTLCache
+from database import db_dependency
+from hashing import hash_password, verify_password
 from models import User
-from schemas import UserLogIn
-
-import os
-
-from dotenv import load_dotenv
-
-
-load_dotenv()
+from schemas import UserInfo, UserLogIn
+from settings import SECRET_KEY, ALGORITHM, USER_CACHE_SIZE, USER_CACHE_TTL, AUTH_TRUST_CLAIMS
 
 
 router = APIRouter(
@@ -28,11 +24,12 @@ router = APIRouter(
     tags=["auth"]
 )
 
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM =os.getenv("ALGORITHM")
+PRINCIPAL_CLAIMS = ("first_name", "last_name", "is_organizer")
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
 
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
+oauth2_optional_bearer = OAuth2PasswordBearer(tokenUrl='auth/token', auto_error=False)
 
 
 class CreateUserRequest (BaseModel):
@@ -48,20 +45,10 @@ class Token (BaseModel):
     token_type: str
 
 
-def get_db():
-    db = sessionLocal()
-    
-    try:
-        yield db
-    finally:
-        db.close() 
-
-db_dependency = Annotated[Session, Depends(get_db)]
-
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency, create_user_request: CreateUserRequest):
     
-    user = db.query(User).filter(User.username == create_user_request.username).first()
+    user = await db.scalar(select(User).where(User.username == create_user_request.username))
 
     if user:
         raise HTTPException(status_code=400, detail="User with such username already exists")
@@ -70,39 +57,46 @@ async def create_user(db: db_dependency, create_user_request: CreateUserRequest)
         username=create_user_request.username,
         first_name=create_user_request.first_name,
         last_name=create_user_request.last_name,
-        hashed_password=bcrypt_context.hash(create_user_request.password)
+        hashed_password=await hash_password(create_user_request.password)
     )
     
     db.add(create_user_model)
-    db.commit()
+    await db.commit()
 
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: UserLogIn,
         db: db_dependency):
-    print(1)
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
 
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate user.')
     
-    token = create_access_token(user.username, user.id, timedelta(minutes=20))
+    token = create_access_token(user.username, user.id, timedelta(minutes=20),
+        claims={claim: getattr(user, claim) for claim in PRINCIPAL_CLAIMS})
     return {"access_token": token, "token_type": "bearer"}
 
 
-def authenticate_user(username: str, password: str, db):
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_user(username: str, password: str, db):
+    user = await db.scalar(select(User).where(User.username == username))
 
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+
+    valid, new_hash = await verify_password(password, user.hashed_password)
+
+    if not valid:
         return False
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     
     return user
 
 
-def create_access_token(username: str, user_id: int, expires_delta: timedelta | None = None):
-    encode = {"sub": username, "id": user_id}
+def create_access_token(username: str, user_id: int, expires_delta: timedelta | None = None,
+        claims: dict | None = None):
+    encode = {"sub": username, "id": user_id, **(claims or {})}
 
     if expires_delta:
         expires = datetime.now(timezone.utc) + expires_delta
@@ -126,15 +120,51 @@ async def get_current_user(token: Annotated[str, Depends (oauth2_bearer)],
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                 detail='Could not validate user.')
         
-        user = db.query(User).filter(User.id == user_id).first()
-        
-        return user
+        if AUTH_TRUST_CLAIMS and all(claim in payload for claim in PRINCIPAL_CLAIMS):
+            return UserInfo(id=user_id, username=username,
+                **{claim: payload[claim] for claim in PRINCIPAL_CLAIMS})
+
+        principal = user_cache.get(user_id)
+
+        if principal is None:
+            user = await db.get(User, user_id)
+
+            if user is None:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail='Could not validate user.')
+
+            principal = UserInfo.model_validate(user, from_attributes=True)
+            user_cache.set(user_id, principal)
+
+        return principal
     
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Could not validate user. ')
 
 
+def get_optional_user_id(token: Annotated[str | None, Depends(oauth2_optional_bearer)]) -> int | None:
+    # For public reads that personalise when a valid token is sent, anything else reads as anonymous
+    if token is None:
+        return None
+
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get('id')
+    except JWTError:
+        return None
+
+
+def invalidate_user(user_id: int):
+    # Call whenever a user row changes so the next request re-reads it
+    user_cache.pop(user_id)
+
+
+@listens_for(User, "after_update")
+@listens_for(User, "after_delete")
+def invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.id)
+
+
 def verify_token(token: str = Depends(oauth2_bearer)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -0,0 +1,288 @@
+import csv
+import io
+from datetime import datetime
+from typing import Literal
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError
+from starlette import status
+
+from cache import response_cache
+from database import db_dependency, asyncSessionLocal
+from geo import geo_cell
+from models import Event, Venue, EventLike, VenueLike, EventComment, VenueComment
+from schemas import UserInfo, EventCreate, VenueCreate, ImportReport, ImportRowError
+from search import search_index
+from timeline import event_timeline
+
+from .auth import get_current_user
+
+
+router = APIRouter(
+    prefix="/bulk",
+    tags=["bulk"]
+)
+
+BATCH_SIZE = 500
+MAX_LINE_BYTES = 1 << 20
+MAX_REPORTED_ERRORS = 1000
+EXPORT_BATCH_SIZE = 1000
+
+IMPORTS = {
+    "events": (Event, EventCreate),
+    "venues": (Venue, VenueCreate),
+}
+
+EXPORTS = {
+    "events": Event,
+    "venues": Venue,
+    "event_likes": EventLike,
+    "venue_likes": VenueLike,
+    "event_comments": EventComment,
+    "venue_comments": VenueComment,
+}
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+# Streaming input
+
+async def read_lines(request: Request):
+    buffer = b""
+
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+
+        if len(buffer) > MAX_LINE_BYTES:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Line too long")
+
+        for line in lines:
+            yield line.decode("utf-8", errors="replace").rstrip("\r")
+
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace").rstrip("\r")
+
+
+async def read_ndjson(request: Request):
+    number = 0
+
+    async for line in read_lines(request):
+        number += 1
+        if not line.strip():
+            continue
+
+        try:
+            yield number, orjson.loads(line)
+        except orjson.JSONDecodeError as error:
+            yield number, error
+
+
+def parse_csv_record(lines: list[str]):
+    # None while a quoted field is still open at the last line; strict mode
+    # tells that apart from a quote inside an unquoted field, which is kept as is
+    try:
+        return next(csv.reader(lines, strict=True))
+    except csv.Error as error:
+        if str(error) == "unexpected end of data":
+            return None
+        return error
+
+
+async def read_csv(request: Request):
+    header = None
+    number = 0
+    pending = []
+    size = 0
+
+    async for line in read_lines(request):
+        # A quoted field may span lines, only a line with a quote can close it
+        if pending and '"' not in line:
+            values = None
+        else:
+            values = parse_csv_record(pending + [line + "\n"])
+
+        pending.append(line + "\n")
+        size += len(line) + 1
+
+        if values is None:
+            if size > MAX_LINE_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail="Record too long")
+            continue
+
+        text = "".join(pending)
+        pending.clear()
+        size = 0
+
+        if not text.strip():
+            continue
+
+        if header is None:
+            if isinstance(values, Exception):
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail=f"Invalid header: {values}")
+            header = values
+            continue
+
+        number += 1
+        if isinstance(values, Exception):
+            yield number, ValueError(str(values))
+        elif len(values) != len(header):
+            yield number, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+        else:
+            yield number, dict(zip(header, values))
+
+    # Whatever is left at the end never closed its quote
+    if pending and header is None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Invalid header: unterminated quoted field")
+    if pending:
+        yield number + 1, ValueError("Unterminated quoted field")
+
+
+# Import
+
+def describe(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, detail['loc'])) or 'row'}: {detail['msg']}"
+            for detail in error.errors(include_url=False))
+
+    return str(error)
+
+
+async def insert_batch(db, model, rows, errors) -> int:
+    if not rows:
+        return 0
+
+    try:
+        await db.execute(insert(model), [values for _, values in rows])
+        await db.commit()
+        return len(rows)
+
+    except DBAPIError:
+        await db.rollback()
+
+    # Only a failed batch pays for row by row inserts, to pin down the bad rows
+    inserted = 0
+    for number, values in rows:
+        try:
+            await db.execute(insert(model), [values])
+            await db.commit()
+            inserted += 1
+
+        except DBAPIError as error:
+            await db.rollback()
+            errors.append((number, str(error.orig)))
+
+    return inserted
+
+
+@router.post("/import/{kind}", status_code=status.HTTP_200_OK, response_model=ImportReport)
+async def bulk_import(kind: Literal["events", "venues"], request: Request, db: db_dependency,
+        format: Literal["ndjson", "csv"] = "ndjson",
+        current_user: UserInfo = Depends(get_current_user)):
+
+    model, schema = IMPORTS[kind]
+    records = read_ndjson(request) if format == "ndjson" else read_csv(request)
+
+    inserted = failed = 0
+    errors = []
+    batch = []
+
+    async def flush():
+        nonlocal inserted, failed
+        batch_errors = []
+
+        inserted += await insert_batch(db, model, batch, batch_errors)
+        failed += len(batch_errors)
+
+        for number, error in batch_errors:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(ImportRowError(row=number, error=error))
+
+        batch.clear()
+
+    async for number, record in records:
+        try:
+            if isinstance(record, Exception):
+                raise record
+            values = schema.model_validate(record).model_dump()
+
+        except (ValidationError, ValueError, TypeError) as error:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(ImportRowError(row=number, error=describe(error)))
+            continue
+
+        if model is Venue:
+            values["geo_cell"] = geo_cell(values["lat"], values["lng"])
+
+        batch.append((number, values))
+        if len(batch) >= BATCH_SIZE:
+            await flush()
+
+    await flush()
+
+    if inserted:
+        response_cache.invalidate(kind)
+        await search_index.catch_up(db)
+        if model is Event:
+            await event_timeline.catch_up(db)
+
+    return ImportReport(inserted=inserted, failed=failed, errors=errors)
+
+
+# Export
+
+def encode_csv(rows) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    for row in rows:
+        writer.writerow("" if value is None else
+            value.isoformat() if hasattr(value, "isoformat") else value for value in row)
+
+    return out.getvalue().encode()
+
+
+async def export_rows(model, format: str, since: datetime | None):
+    columns = list(model.__table__.columns)
+    stmt = select(*columns).order_by(model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    if since is not None:
+        stmt = stmt.where(model.created_at >= since)
+
+    if format == "csv":
+        yield encode_csv([[column.name for column in columns]])
+
+    # The request's session is closed before the body streams, so the export
+    # holds its own on a replica; stream() keeps a server-side cursor open across batches
+    async with asyncSessionLocal(info={"replica": True}) as db:
+        result = await db.stream(stmt)
+
+        async for rows in result.partitions():
+            if format == "csv":
+                yield encode_csv(rows)
+            else:
+                yield b"".join(orjson.dumps(dict(row._mapping)) + b"\n" for row in rows)
+
+
+@router.get("/export/{kind}", status_code=status.HTTP_200_OK, response_class=StreamingResponse)
+async def bulk_export(kind: Literal["events", "venues", "event_likes", "venue_likes",
+            "event_comments", "venue_comments"],
+        format: Literal["ndjson", "csv"] = "ndjson",
+        since: datetime | None = None,
+        current_user: UserInfo = Depends(get_current_user)):
+
+    return StreamingResponse(export_rows(EXPORTS[kind], format, since),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'})
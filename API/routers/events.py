@@ -1,38 +1,44 @@
-from typing import Annotated 
+from datetime import date, datetime, timedelta
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Response
-from sqlalchemy.sql.expression import text
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
-from sqlalchemy.orm import Session
-from starlette import status 
+from starlette import status
 
-from database import sessionLocal 
+from broker import broker
+from cache import response_cache
+from database import db_dependency, read_db_dependency
+from counters import event_likes
+from favorites import favorite_events
+from search import search_index
+from timeline import event_timeline, entry
+from trending import trending_events, TOP_K
+from recommendations import recommender, TOP_N
 
-from dotenv import load_dotenv
+from models import Event, EventComment, EventLike, Venue
+from projection import Projection
+from pagination import keyset_page, comment_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from schemas import (Page, CommentPage, UserInfo, EventInfo, EventView, EventListItem, EventMapItem, CalendarDay, EventTrending,
+        EventRecommendation,
+        EventLikeCreate,
+        EventLikeInfo, EventCreate, EventCommentCreate, EventCommentInfo, EventCommentDelete)
 
-from models import Event, EventComment, EventLike
-from schemas import (UserInfo, EventLikeCreate, EventCreate,
-        EventCommentCreate, EventCommentInfo, EventCommentBase, EventCommentDelete)
+from .auth import get_current_user, get_optional_user_id
 
-from .auth import get_current_user
-
-
-load_dotenv()
 
 router = APIRouter(
     prefix="/events",
     tags=["events"]
 )
 
-def get_db():
-    db = sessionLocal()
-    
-    try:
-        yield db
-    finally:
-        db.close() 
+event_projection = Projection(Event, EventInfo, {"venue": "venue_id", "organizer": "organizer_id"},
+    always=("id", "num_likes"))
 
-db_dependency = Annotated[Session, Depends(get_db)]
+MAX_MAP_SIZE = 500
+MAX_CALENDAR_DAYS = 62
 
 
 # Events
@@ -42,109 +48,339 @@ async def create_event(event: EventCreate, db: db_dependency):
     db_event = Event(**event.model_dump())
 
     db.add(db_event)
-    db.commit() 
+    await db.commit()
+
+    response_cache.invalidate("events")
+    search_index.add_event(db_event)
+    event_timeline.add_event(db_event)
+
+
+async def load_events(db, event_ids: list[int]) -> list[Event]:
+    # Primary key lookups, returned in the order of the ids
+    if not event_ids:
+        return []
+
+    events = {event.id: event for event in
+        (await db.execute(select(Event).where(Event.id.in_(event_ids)))).scalars()}
+
+    return [events[event_id] for event_id in event_ids if event_id in events]
+
+
+@router.get("/all", status_code=status.HTTP_200_OK, response_model=Page[EventListItem] | Page[EventView])
+async def get_all_events(request: Request, db: read_db_dependency,
+        user_id: int | None = Depends(get_optional_user_id),
+        cursor: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        fields: str | None = None,
+        include: str | None = None,
+        event_type: str | None = None,
+        venue_id: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None):
+
+    stmt = select(Event)
+
+    if event_type is not None:
+        stmt = stmt.where(Event.event_type == event_type)
+    if venue_id is not None:
+        stmt = stmt.where(Event.venue_id == venue_id)
+    if date_from is not None:
+        stmt = stmt.where(Event.date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Event.date < date_to)
+
+    projection = event_projection.parse(fields, include)
+
+    # The cached page is shared, liked_by_me is added per user on the way out
+    liked = await favorite_events.get(db, user_id) if user_id is not None else None
+    annotate = liked.annotate if liked is not None else None
+
+    if projection is None:
+        return await response_cache.respond(request, ["events"],
+            lambda: keyset_page(db, stmt, Event, cursor, limit), Page[EventInfo], annotate=annotate)
+
+    async def load():
+        page = await keyset_page(db, stmt.options(*event_projection.options(*projection)),
+            Event, cursor, limit)
+        page["items"] = [event_projection.dump(event, *projection) for event in page["items"]]
+
+        return page
+
+    # Included venues carry their own like counts
+    tags = ["events", "venues"] if "venue" in projection[1] else ["events"]
+
+    return await response_cache.respond(request, tags, load, Page[EventView], exclude_unset=True,
+        annotate=annotate)
+
 
+@router.get("/map", status_code=status.HTTP_200_OK, response_model=list[EventMapItem])
+async def get_events_map(request: Request, db: read_db_dependency,
+        limit: Annotated[int, Query(ge=1, le=MAX_MAP_SIZE)] = MAX_MAP_SIZE,
+        event_type: str | None = None,
+        date_from: datetime | None = None):
 
-@router.get("/all", status_code=status.HTTP_200_OK)
-async def get_all_events(db: db_dependency):
-    
-    events = db.query(Event).order_by(text("num_likes")).all()
-    
-    return events
+    # Only what the home page renders, venue coordinates joined in
+    stmt = (select(Event.id, Event.title, Event.description, Event.date,
+                Event.poster_image_link, Event.venue_id,
+                Venue.name.label("venue_name"), Venue.lat, Venue.lng)
+        .join(Venue, Event.venue_id == Venue.id))
 
-@router.get("/favorites", status_code=status.HTTP_200_OK)
-async def get_favorite_events(db: db_dependency, 
+    if event_type is not None:
+        stmt = stmt.where(Event.event_type == event_type)
+    if date_from is not None:
+        stmt = stmt.where(Event.date >= date_from)
+
+    stmt = stmt.order_by(Event.num_likes.desc(), Event.id.desc()).limit(limit)
+
+    async def load():
+        return (await db.execute(stmt)).mappings().all()
+
+    return await response_cache.respond(request, ["events", "venues"], load, list[EventMapItem])
+
+@router.get("/favorites", status_code=status.HTTP_200_OK, response_model=Page[EventInfo])
+async def get_favorite_events(db: read_db_dependency,
+        current_user: UserInfo = Depends(get_current_user),
+        cursor: int | None = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE):
+
+    # Most recently liked first, the like id is the cursor
+    stmt = (select(Event, EventLike.id)
+        .join(EventLike, EventLike.event == Event.id)
+        .where(EventLike.owner_id == current_user.id))
+
+    if cursor is not None:
+        stmt = stmt.where(EventLike.id < cursor)
+
+    rows = (await db.execute(stmt.order_by(EventLike.id.desc()).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1][1])
+
+    return {"items": [event for event, _ in rows], "next_cursor": next_cursor}
+
+
+@router.get("/favorites/ids", status_code=status.HTTP_200_OK, response_model=list[int])
+async def get_favorite_event_ids(db: read_db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
-    likes = db.query(EventLike).filter(EventLike.owner_id == current_user.id).all()
-    events = []
 
-    for like in likes:
-        event = db.query(Event).filter(Event.id == like.event).first()
-        events.append(event)
+    return list(await favorite_events.get(db, current_user.id))
 
-    return events
 
+# Calendar
 
-@router.get("/{event_id}", status_code=status.HTTP_200_OK)
-async def get_event(event_id: int, db: db_dependency):
-    event = db.query(Event).filter(Event.id == event_id).first()
+@router.get("/upcoming", status_code=status.HTTP_200_OK, response_model=Page[EventInfo])
+async def get_upcoming_events(db: read_db_dependency,
+        cursor: int | None = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE):
 
-    if not event:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    
-    return event
+    # Served from the in-memory timeline, the previous page's last event id is the cursor
+    after = None
+    if cursor is not None:
+        after = event_timeline.position(cursor)
+        if after is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    event_ids = event_timeline.upcoming(datetime.now(), after, limit + 1)
+
+    next_cursor = None
+    if len(event_ids) > limit:
+        event_ids = event_ids[:limit]
+        next_cursor = str(event_ids[-1])
+
+    return {"items": await load_events(db, event_ids), "next_cursor": next_cursor}
+
+
+@router.get("/happening-now", status_code=status.HTTP_200_OK, response_model=list[EventInfo])
+async def get_happening_events(db: read_db_dependency):
+    return await load_events(db, event_timeline.happening(datetime.now()))
+
+
+@router.get("/calendar", status_code=status.HTTP_200_OK, response_model=list[CalendarDay])
+async def get_calendar(request: Request, db: read_db_dependency,
+        date_from: Annotated[date, Query(alias="from")],
+        date_to: Annotated[date, Query(alias="to")]):
+
+    # Both days are included
+    if date_to < date_from or (date_to - date_from).days >= MAX_CALENDAR_DAYS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Range must be 1 to {MAX_CALENDAR_DAYS} days")
+
+    async def load():
+        if event_timeline.covers(date_from, date_to):
+            days = event_timeline.between(date_from, date_to)
+            events = {event.id: event for event in
+                await load_events(db, [event_id for ids in days.values() for event_id in ids])}
+
+            return [{"day": day, "events": [events[event_id] for event_id in ids if event_id in events]}
+                for day, ids in days.items()]
+
+        # Outside the timeline window, the (date, start) index serves the range
+        rows = (await db.execute(select(Event)
+            .where(Event.date >= date_from, Event.date < date_to + timedelta(days=1))
+            .order_by(Event.date, Event.start, Event.id))).scalars().all()
+
+        days = {}
+        for event in sorted(rows, key=lambda event: (event.date.date(),
+                entry(event.id, event.date, event.start, event.finish))):
+            days.setdefault(event.date.date(), []).append(event)
+
+        return [{"day": day, "events": events} for day, events in days.items()]
+
+    return await response_cache.respond(request, ["events"], load, list[CalendarDay])
+
+
+# Trending
+
+@router.get("/trending", status_code=status.HTTP_200_OK, response_model=list[EventTrending])
+async def get_trending_events(db: read_db_dependency,
+        limit: Annotated[int, Query(ge=1, le=TOP_K)] = DEFAULT_PAGE_SIZE):
+
+    ranked = trending_events.trending(limit)
+    events = {event.id: event for event in await load_events(db, [event_id for event_id, _ in ranked])}
+
+    return [{"event": events[event_id], "score": round(score, 4)}
+        for event_id, score in ranked if event_id in events]
+
+
+@router.get("/recommended", status_code=status.HTTP_200_OK, response_model=list[EventRecommendation])
+async def get_recommended_events(db: read_db_dependency,
+        current_user: UserInfo = Depends(get_current_user),
+        limit: Annotated[int, Query(ge=1, le=TOP_N)] = DEFAULT_PAGE_SIZE):
+
+    # Likes newer than the model are filtered out through the favorites cache
+    liked = await favorite_events.get(db, current_user.id)
+    ranked = [item for item in recommender.recommend(current_user.id, TOP_N) if item[0] not in liked]
+
+    # Users with no likes to go on get what is trending instead
+    if not ranked:
+        ranked = [item for item in trending_events.trending(TOP_K) if item[0] not in liked]
+
+    ranked = ranked[:limit]
+    events = {event.id: event for event in await load_events(db, [event_id for event_id, _ in ranked])}
+
+    return [{"event": events[event_id], "score": round(score, 4)}
+        for event_id, score in ranked if event_id in events]
+
+
+@router.get("/{event_id}", status_code=status.HTTP_200_OK, response_model=EventInfo | EventView)
+async def get_event(event_id: int, request: Request, db: read_db_dependency,
+        fields: str | None = None,
+        include: str | None = None):
+
+    projection = event_projection.parse(fields, include)
+    options = event_projection.options(*projection, many=False) if projection else []
+
+    async def load():
+        event = await db.get(Event, event_id, options=options)
+
+        if not event:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+        return event_projection.dump(event, *projection) if projection else event
+
+    tags = ["event:" + str(event_id)]
+    if projection and "venue" in projection[1]:
+        tags.append("venues")
+
+    return await response_cache.respond(request, tags, load,
+        EventView if projection else EventInfo, exclude_unset=projection is not None)
 
 # Likes
 
-@router.post("/like", status_code=status.HTTP_201_CREATED)
+@router.post("/like", status_code=status.HTTP_201_CREATED, response_model=EventLikeInfo)
 async def create_event_like(event_like: EventLikeCreate, db: db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
-    print(1)
-    check_db_event_like = db.query(EventLike).filter(EventLike.event == event_like.event,
-        EventLike.owner_id == current_user.id).first()
 
-    if not check_db_event_like:
-        event = db.query(Event).filter(Event.id == event_like.event).first()
-        event.num_likes += 1
+    db_event_like = EventLike(**event_like.model_dump(), owner_id=current_user.id)
+    db.add(db_event_like)
+
+    # The (owner_id, event) unique constraint makes the insert the only check needed
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+
+        if not await db.get(Event, event_like.event):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-        db_event_like = EventLike(**event_like.model_dump(), owner_id=current_user.id)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-        db.add(db_event_like)
-        db.commit() 
-        db.refresh(db_event_like)
+    event_likes.add(event_like.event, 1)
+    broker.publish_likes(f"event:{event_like.event}", 1)
+    favorite_events.add(current_user.id, event_like.event)
+    trending_events.record(event_like.event, db_event_like.id)
+    await db.refresh(db_event_like)
 
-        return db_event_like
-    
-    return Response(status_code=status.HTTP_204_NO_CONTENT) 
+    return db_event_like
 
 
 @router.delete("/like/delete", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_event_like(event_like: EventLikeCreate, db: db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
-    
-    check_db_event_like = db.query(EventLike).filter(EventLike.event == event_like.event,
-        EventLike.owner_id == current_user.id)
-    
-    if check_db_event_like:
-        event = db.query(Event).filter(Event.id == event_like.event).first()
-        check_db_event_like.delete(synchronize_session=False)
-        event.num_likes -= 1 
 
-        if event.num_likes < 0:
-            event.num_likes = 0
+    # Read first, the like's age is what has to come off its trending score
+    like = (await db.execute(select(EventLike.id, EventLike.created_at).where(
+        EventLike.event == event_like.event, EventLike.owner_id == current_user.id))).first()
 
-    db.commit()
+    if like is None:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    result = await db.execute(delete(EventLike).where(EventLike.id == like.id))
+
+    await db.commit()
+
+    if result.rowcount:
+        event_likes.add(event_like.event, -1)
+        broker.publish_likes(f"event:{event_like.event}", -1)
+        favorite_events.discard(current_user.id, event_like.event)
+        trending_events.retract(event_like.event, like.created_at)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 # Comments
 
-@router.post("/comment", status_code=status.HTTP_201_CREATED, response_model= EventCommentInfo)
-def create_event_comment(event_comment: EventCommentCreate, db: Session = Depends(get_db),
+@router.post("/comment", status_code=status.HTTP_201_CREATED, response_model=EventCommentInfo)
+async def create_event_comment(event_comment: EventCommentCreate, db: db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
 
     new_comment = EventComment(**event_comment.model_dump(), owner_id=current_user.id)
-    
+
     db.add(new_comment)
-    db.commit()
-    db.refresh(new_comment)
 
-    return Response(status_code=status.HTTP_201_CREATED)
+    # The foreign key rejects comments on a missing event
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    await db.refresh(new_comment, ["created_at", "owner"])
 
+    response_cache.invalidate(f"event:{new_comment.event}:comments")
+    broker.publish(f"event:{new_comment.event}", {"type": "comment",
+        "comment": EventCommentInfo.model_validate(new_comment).model_dump(mode="json")})
 
-@router.get("/{event_id}/comment", status_code=status.HTTP_200_OK)
-def get_event_comments(event_id: int, db: Session = Depends(get_db)):
+    return new_comment
 
-    comments = db.query(EventComment).filter(EventComment.event == event_id).order_by(text("-created_at")).all()
 
-    return comments
+@router.get("/{event_id}/comment", status_code=status.HTTP_200_OK,
+        response_model=CommentPage[EventCommentInfo])
+async def get_event_comments(event_id: int, request: Request, db: read_db_dependency,
+        before: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE):
 
+    return await response_cache.respond(request, ["event:" + str(event_id) + ":comments"],
+        lambda: comment_page(db, EventComment, EventComment.event, event_id, before, limit),
+        CommentPage[EventCommentInfo])
 
-@router.get("/comment/{comment_id}", status_code=status.HTTP_200_OK)
-def get_comment(comment_id: int, db: Session = Depends(get_db)):
 
-    comment = db.query(EventComment).filter(EventComment.id == comment_id).first()
+@router.get("/comment/{comment_id}", status_code=status.HTTP_200_OK, response_model=EventCommentInfo)
+async def get_comment(comment_id: int, db: read_db_dependency):
+
+    comment = await db.get(EventComment, comment_id, options=[selectinload(EventComment.owner)])
 
     if not comment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -157,13 +393,15 @@ def get_comment(comment_id: int, db: Session = Depends(get_db)):
 async def delete_event_comment(event_comment: EventCommentDelete, db: db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
 
-    check_db_event_comment = db.query(EventComment).filter(EventComment.id == event_comment.id,
-        EventComment.owner_id == current_user.id)
-    
-    if check_db_event_comment:
-        check_db_event_comment.delete(synchronize_session=False)
+    event_id = await db.scalar(select(EventComment.event).where(EventComment.id == event_comment.id,
+        EventComment.owner_id == current_user.id))
+
+    if event_id is not None:
+        await db.execute(delete(EventComment).where(EventComment.id == event_comment.id))
+        await db.commit()
 
-    db.commit()
+        response_cache.invalidate(f"event:{event_id}:comments")
+        broker.publish(f"event:{event_id}", {"type": "comment_deleted", "id": event_comment.id})
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
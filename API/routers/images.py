@@ -0,0 +1,128 @@
+import re
+from typing import Literal
+
+import aiofiles
+import aiofiles.os
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette import status
+
+import images
+from cache import etag_matches
+from schemas import UserInfo, ImageInfo
+
+from .auth import get_current_user
+
+
+router = APIRouter(
+    prefix="/images",
+    tags=["images"]
+)
+
+CHUNK_SIZE = 64 << 10
+
+# Content-addressed files never change, clients and proxies may keep them forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def image_info(digest: str, content_type: str) -> ImageInfo:
+    return ImageInfo(digest=digest, content_type=content_type,
+        url=f"/images/{digest}",
+        variants={variant: f"/images/{digest}?variant={variant}" for variant in images.VARIANTS})
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    # Only a single range is served, anything else falls back to the full body
+    match = RANGE_RE.match(header.replace(" ", ""))
+    if match is None or not any(match.groups()):
+        return None
+
+    first, last = match.groups()
+
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+
+    if start >= size or start > end:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"})
+
+    return start, end
+
+
+async def read_file(path, start: int, length: int):
+    async with aiofiles.open(path, "rb") as file:
+        await file.seek(start)
+
+        while length > 0:
+            chunk = await file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+
+            length -= len(chunk)
+            yield chunk
+
+
+@router.post("", status_code=status.HTTP_201_CREATED, response_model=ImageInfo)
+async def upload_image(request: Request, current_user: UserInfo = Depends(get_current_user)):
+    # The body is the raw image, streamed to disk instead of buffered by a form parser
+    try:
+        digest, content_type = await images.store(request.stream())
+
+    except images.ImageTooLarge:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Image too large")
+
+    except images.InvalidImage:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Unsupported image")
+
+    images.render_variants(digest)
+
+    return image_info(digest, content_type)
+
+
+@router.get("/{digest}", status_code=status.HTTP_200_OK, response_class=StreamingResponse)
+async def read_image(digest: str, request: Request,
+        variant: Literal["original", "thumb", "medium"] = "original"):
+
+    if not images.is_digest(digest) or not await aiofiles.os.path.exists(images.original_path(digest)):
+        raise HTTPException(status_code=404, detail='Image not found')
+
+    if variant == "original":
+        path = images.original_path(digest)
+        content_type = await images.mime_type(digest)
+    else:
+        path = images.variant_path(digest, variant)
+        if not await aiofiles.os.path.exists(path):
+            await images.ensure_variant(digest, variant)
+        content_type = "image/webp"
+
+    etag = f'"{digest[:32]}-{variant}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    size = (await aiofiles.os.stat(path)).st_size
+    byte_range = None
+
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(read_file(path, 0, size), media_type=content_type,
+            headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(read_file(path, start, end - start + 1),
+        status_code=status.HTTP_206_PARTIAL_CONTENT, media_type=content_type, headers=headers)
@@ -0,0 +1,53 @@
+import asyncio
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+
+from broker import broker
+from settings import LIVE_SEND_TIMEOUT as SEND_TIMEOUT
+
+
+router = APIRouter(
+    tags=["live"]
+)
+
+
+async def stream_topic(websocket: WebSocket, topic: str):
+    await websocket.accept()
+    subscription = broker.subscribe(topic)
+
+    async def send():
+        while True:
+            message = await subscription.next()
+            await asyncio.wait_for(websocket.send_json(message), SEND_TIMEOUT)
+
+    async def receive():
+        # Clients do not send anything, this only notices the disconnect
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(send()), asyncio.create_task(receive())]
+
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in done:
+            if isinstance(task.exception(), asyncio.TimeoutError):
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        for task in tasks:
+            task.cancel()
+        broker.unsubscribe(subscription)
+
+
+@router.websocket("/events/{event_id}/live")
+async def event_live(websocket: WebSocket, event_id: int):
+    await stream_topic(websocket, f"event:{event_id}")
+
+
+@router.websocket("/venues/{venue_id}/live")
+async def venue_live(websocket: WebSocket, venue_id: int):
+    await stream_topic(websocket, f"venue:{venue_id}")
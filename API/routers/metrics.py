@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette import status
+
+import metrics
+
+
+router = APIRouter(
+    tags=["metrics"]
+)
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", status_code=status.HTTP_200_OK, response_class=PlainTextResponse,
+        include_in_schema=False)
+async def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
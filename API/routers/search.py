@@ -0,0 +1,23 @@
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, Query
+from starlette import status
+
+from schemas import SearchResult
+from search import search_index
+
+
+router = APIRouter(
+    prefix="/search",
+    tags=["search"]
+)
+
+MAX_SEARCH_RESULTS = 100
+
+
+@router.get("", status_code=status.HTTP_200_OK, response_model=list[SearchResult])
+async def search(q: Annotated[str, Query(min_length=1, max_length=255)],
+        type: Literal["event", "venue"] | None = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_SEARCH_RESULTS)] = 20):
+
+    return search_index.search(q, kind=type, limit=limit)
@@ -1,86 +1,178 @@
-from typing import Annotated 
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Response
-from sqlalchemy.sql.expression import text
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from sqlalchemy import select, delete, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
-from sqlalchemy.orm import Session
-from starlette import status 
+from starlette import status
 
-from database import sessionLocal 
-
-from dotenv import load_dotenv
+from broker import broker
+from cache import response_cache
+from database import db_dependency, read_db_dependency
+from counters import venue_likes
+from favorites import favorite_venues
+from search import search_index
+from trending import trending_venues, TOP_K
 
 from models import Venue, VenueComment, VenueLike
-from schemas import (UserInfo, VenueLikeCreate, VenueCreate,
-        VenueCommentCreate, VenueCommentInfo, VenueCommentBase)
-
-from .auth import get_current_user
+from projection import Projection
+from pagination import keyset_page, comment_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from geo import bounding_box, cell_ranges, haversine_km
+from schemas import (Page, CommentPage, UserInfo, VenueInfo, VenueView, VenueListItem, VenueNearby, VenueTrending,
+        VenueLikeCreate,
+        VenueLikeInfo, VenueCreate, VenueCommentCreate, VenueCommentInfo, VenueCommentBase)
 
+from .auth import get_current_user, get_optional_user_id
 
-load_dotenv()
 
 router = APIRouter(
     prefix="/venues",
     tags=["venues"]
 )
 
-def get_db():
-    db = sessionLocal()
-    
-    try:
-        yield db
-    finally:
-        db.close() 
+venue_projection = Projection(Venue, VenueInfo, always=("id", "num_likes"))
 
-db_dependency = Annotated[Session, Depends(get_db)]
+MAX_NEARBY_RADIUS_KM = 50
 
 
 # Venues
 
 @router.post("", status_code=status.HTTP_201_CREATED)
 async def create_venue(venue: VenueCreate, db: db_dependency):
-    print(1)
     db_venue = Venue(**venue.model_dump())
 
     db.add(db_venue)
-    db.commit() 
+    await db.commit()
 
+    response_cache.invalidate("venues")
+    search_index.add_venue(db_venue)
 
-@router.get("/all", status_code=status.HTTP_200_OK)
-async def get_all_venues(db: db_dependency):
-    
-    venues = db.query(Venue).order_by(text("num_likes")).all()
-    
-    return venues
 
+@router.get("/all", status_code=status.HTTP_200_OK, response_model=Page[VenueListItem] | Page[VenueView])
+async def get_all_venues(request: Request, db: read_db_dependency,
+        user_id: int | None = Depends(get_optional_user_id),
+        cursor: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        fields: str | None = None,
+        include: str | None = None,
+        venue_type: str | None = None):
 
-@router.get("/{venue_id}", status_code=status.HTTP_200_OK)
-async def get_venue(venue_id: int, db: db_dependency):
-    venue = db.query(Venue).filter(Venue.id == venue_id).first()
+    stmt = select(Venue)
 
-    if not venue:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    
-    return venue
+    if venue_type is not None:
+        stmt = stmt.where(Venue.venue_type == venue_type)
+
+    projection = venue_projection.parse(fields, include)
+
+    # The cached page is shared, liked_by_me is added per user on the way out
+    liked = await favorite_venues.get(db, user_id) if user_id is not None else None
+    annotate = liked.annotate if liked is not None else None
+
+    if projection is None:
+        return await response_cache.respond(request, ["venues"],
+            lambda: keyset_page(db, stmt, Venue, cursor, limit), Page[VenueInfo], annotate=annotate)
+
+    async def load():
+        page = await keyset_page(db, stmt.options(*venue_projection.options(*projection)),
+            Venue, cursor, limit)
+        page["items"] = [venue_projection.dump(venue, *projection) for venue in page["items"]]
+
+        return page
+
+    return await response_cache.respond(request, ["venues"], load, Page[VenueView], exclude_unset=True,
+        annotate=annotate)
+
+
+@router.get("/nearby", status_code=status.HTTP_200_OK, response_model=list[VenueNearby])
+async def get_nearby_venues(db: read_db_dependency,
+        lat: Annotated[float, Query(ge=-90, le=90)],
+        lng: Annotated[float, Query(ge=-180, le=180)],
+        radius: Annotated[float, Query(gt=0, le=MAX_NEARBY_RADIUS_KM)] = 1,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        venue_type: str | None = None):
+
+    # Index range scans over the grid cells covering the box, then exact distances
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius)
+
+    stmt = select(Venue).where(
+        or_(*(Venue.geo_cell.between(lo, hi)
+            for lo, hi in cell_ranges(min_lat, max_lat, min_lng, max_lng))),
+        Venue.lat.between(min_lat, max_lat),
+        Venue.lng.between(min_lng, max_lng))
+
+    if venue_type is not None:
+        stmt = stmt.where(Venue.venue_type == venue_type)
+
+    venues = (await db.execute(stmt)).scalars().all()
+
+    nearby = []
+    for venue in venues:
+        distance = haversine_km(lat, lng, venue.lat, venue.lng)
+        if distance <= radius:
+            nearby.append({"venue": venue, "distance_km": round(distance, 3)})
+
+    nearby.sort(key=lambda item: item["distance_km"])
+
+    return nearby[:limit]
+
+
+@router.get("/trending", status_code=status.HTTP_200_OK, response_model=list[VenueTrending])
+async def get_trending_venues(db: read_db_dependency,
+        limit: Annotated[int, Query(ge=1, le=TOP_K)] = DEFAULT_PAGE_SIZE):
+
+    ranked = trending_venues.trending(limit)
+    venues = {venue.id: venue for venue in (await db.execute(
+        select(Venue).where(Venue.id.in_([venue_id for venue_id, _ in ranked])))).scalars()}
+
+    return [{"venue": venues[venue_id], "score": round(score, 4)}
+        for venue_id, score in ranked if venue_id in venues]
+
+
+@router.get("/{venue_id}", status_code=status.HTTP_200_OK, response_model=VenueInfo | VenueView)
+async def get_venue(venue_id: int, request: Request, db: read_db_dependency,
+        fields: str | None = None,
+        include: str | None = None):
+
+    projection = venue_projection.parse(fields, include)
+    options = venue_projection.options(*projection, many=False) if projection else []
+
+    async def load():
+        venue = await db.get(Venue, venue_id, options=options)
+
+        if not venue:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+        return venue_projection.dump(venue, *projection) if projection else venue
+
+    return await response_cache.respond(request, ["venue:" + str(venue_id)], load,
+        VenueView if projection else VenueInfo, exclude_unset=projection is not None)
 
 # Likes
 
-@router.post("/like", status_code=status.HTTP_201_CREATED)
+@router.post("/like", status_code=status.HTTP_201_CREATED, response_model=VenueLikeInfo)
 async def create_venue_like(venue_like: VenueLikeCreate, db: db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
 
-    check_db_venue_like = db.query(VenueLike).filter(VenueLike.venue == venue_like.venue,
-        VenueLike.owner_id == current_user.id).first()
+    db_venue_like = VenueLike(**venue_like.model_dump(), owner_id=current_user.id)
+    db.add(db_venue_like)
 
-    if not check_db_venue_like:
-        venue = db.query(Venue).filter(Venue.id == venue_like.venue).first()
-        venue.num_likes += 1
+    # The (owner_id, venue) unique constraint makes the insert the only check needed
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
 
-        db_venue_like = VenueLike(**venue_like.model_dump(), owner_id=current_user.id)
+        if not await db.get(Venue, venue_like.venue):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    db.add(db_venue_like)
-    db.commit() 
-    db.refresh(db_venue_like)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    venue_likes.add(venue_like.venue, 1)
+    favorite_venues.add(current_user.id, venue_like.venue)
+    broker.publish_likes(f"venue:{venue_like.venue}", 1)
+    trending_venues.record(venue_like.venue, db_venue_like.id)
+    await db.refresh(db_venue_like)
 
     return db_venue_like
 
@@ -88,52 +180,68 @@ async def create_venue_like(venue_like: VenueLikeCreate, db: db_dependency,
 @router.delete("/like/delete", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_venue_like(venue_like: VenueLikeCreate, db: db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
-    
-    check_db_venue_like = db.query(VenueLike).filter(VenueLike.venue == venue_like.venue,
-        VenueLike.owner_id == current_user.id)
-    
-    if check_db_venue_like:
-        venue = db.query(Venue).filter(Venue.id == venue_like.venue).first()
-        check_db_venue_like.delete(synchronize_session=False)
-        venue.num_likes -= 1 
 
-        if venue.num_likes < 0:
-            venue.num_likes = 0
+    # Read first, the like's age is what has to come off its trending score
+    like = (await db.execute(select(VenueLike.id, VenueLike.created_at).where(
+        VenueLike.venue == venue_like.venue, VenueLike.owner_id == current_user.id))).first()
 
-    db.commit()
+    if like is None:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    result = await db.execute(delete(VenueLike).where(VenueLike.id == like.id))
 
+    await db.commit()
 
+    if result.rowcount:
+        venue_likes.add(venue_like.venue, -1)
+        favorite_venues.discard(current_user.id, venue_like.venue)
+        broker.publish_likes(f"venue:{venue_like.venue}", -1)
+        trending_venues.retract(venue_like.venue, like.created_at)
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 # Comments
 
-@router.post("/comment", status_code=status.HTTP_201_CREATED, response_model= VenueCommentInfo)
-def create_venue_comment(venue_comment: VenueCommentCreate, db: Session = Depends(get_db),
+@router.post("/comment", status_code=status.HTTP_201_CREATED, response_model=VenueCommentInfo)
+async def create_venue_comment(venue_comment: VenueCommentCreate, db: db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
 
     new_comment = VenueComment(**venue_comment.model_dump(), owner_id=current_user.id)
-    
+
     db.add(new_comment)
-    db.commit()
-    db.refresh(new_comment)
 
-    return Response(status_code=status.HTTP_201_CREATED)
+    # The foreign key rejects comments on a missing venue
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    await db.refresh(new_comment, ["created_at", "owner"])
 
+    response_cache.invalidate(f"venue:{new_comment.venue}:comments")
+    broker.publish(f"venue:{new_comment.venue}", {"type": "comment",
+        "comment": VenueCommentInfo.model_validate(new_comment).model_dump(mode="json")})
 
-@router.get("/{venue_id}/comment", status_code=status.HTTP_200_OK)
-def get_venue_comments(venue_id: int, db: Session = Depends(get_db)):
+    return new_comment
 
-    comments = db.query(VenueComment).filter(VenueComment.venue == venue_id).order_by(text("-created_at")).all()
 
-    return comments
+@router.get("/{venue_id}/comment", status_code=status.HTTP_200_OK,
+        response_model=CommentPage[VenueCommentInfo])
+async def get_venue_comments(venue_id: int, request: Request, db: read_db_dependency,
+        before: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE):
 
+    return await response_cache.respond(request, ["venue:" + str(venue_id) + ":comments"],
+        lambda: comment_page(db, VenueComment, VenueComment.venue, venue_id, before, limit),
+        CommentPage[VenueCommentInfo])
 
-@router.get("/comment/{comment_id}", status_code=status.HTTP_200_OK)
-def get_comment(comment_id: int, db: Session = Depends(get_db)):
 
-    comment = db.query(VenueComment).filter(VenueComment.id == comment_id).first()
+@router.get("/comment/{comment_id}", status_code=status.HTTP_200_OK, response_model=VenueCommentInfo)
+async def get_comment(comment_id: int, db: read_db_dependency):
+
+    comment = await db.get(VenueComment, comment_id, options=[selectinload(VenueComment.owner)])
 
     if not comment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -146,12 +254,16 @@ def get_comment(comment_id: int, db: Session = Depends(get_db)):
 async def delete_venue_comment(venue_comment: VenueCommentBase, db: db_dependency,
         current_user: UserInfo = Depends(get_current_user)):
 
-    check_db_venue_comment = db.query(VenueComment).filter(VenueComment.venue == venue_comment.venue,
-        VenueComment.owner_id == current_user.id)
-    
-    if check_db_venue_comment:
-        check_db_venue_comment.delete(synchronize_session=False)
+    # Ids first, live subscribers are told which comments went away
+    comment_ids = (await db.scalars(select(VenueComment.id).where(VenueComment.venue == venue_comment.venue,
+        VenueComment.owner_id == current_user.id))).all()
+
+    if comment_ids:
+        await db.execute(delete(VenueComment).where(VenueComment.id.in_(comment_ids)))
+        await db.commit()
 
-    db.commit()
+        response_cache.invalidate(f"venue:{venue_comment.venue}:comments")
+        for comment_id in comment_ids:
+            broker.publish(f"venue:{venue_comment.venue}", {"type": "comment_deleted", "id": comment_id})
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
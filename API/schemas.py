@@ -1,11 +1,21 @@
-from pydantic import BaseModel
-from sqlalchemy import DateTime, Enum
+from typing import Generic, TypeVar
 
-from datetime import datetime, time
+from pydantic import BaseModel, ConfigDict, Field
 
-from fastapi_storages.integrations.sqlalchemy import FileType
+from datetime import date, datetime, time
 
 
+T = TypeVar("T")
+
+
+# Pagination
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    next_cursor: str | None
+
+class CommentPage(Page[T], Generic[T]):
+    count: int
+
 # User
 class UserBase(BaseModel):
     username: str
@@ -14,12 +24,14 @@ class UserBase(BaseModel):
     last_name: str
 
 class UserInfo(UserBase):
-    id: int  
-    is_organizer: bool  
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    is_organizer: bool
 
 class UserLogIn(BaseModel):
     username: str
-    password: str    
+    password: str
 
 # Venue
 
@@ -28,40 +40,43 @@ class VenueCommentBase(BaseModel):
     venue: int
 
 class VenueCommentCreate(VenueCommentBase):
-    content: str 
+    content: str
 
 class VenueCommentInfo(VenueCommentBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
 
     content: str
     owner_id: int
     owner: UserInfo
 
-    created_at: time
+    created_at: datetime
 
 # Venue: VenueLike
 class VenueLikeBase(BaseModel):
     venue: int
 
 class VenueLikeCreate(VenueLikeBase):
-    pass 
+    pass
 
 class VenueLikeInfo(VenueLikeBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
 
     owner_id: int
-    owner: UserInfo
 
-    created_at: time
+    created_at: datetime
 
-# Venue: Base    
+# Venue: Base
 class VenueBase(BaseModel):
     name: str
     description: str
     venue_type: str
 
-    lat: str
-    lng: str
+    lat: float = Field(ge=-90, le=90)
+    lng: float = Field(ge=-180, le=180)
 
     work_hours_open: time
     work_hours_close: time
@@ -71,10 +86,51 @@ class VenueCreate(VenueBase):
     pass
 
 class VenueInfo(VenueBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
 
     num_likes: int
-    comments: VenueCommentInfo
+
+    image_1_link: str | None = None
+    image_2_link: str | None = None
+    image_3_link: str | None = None
+
+# Sparse read of a venue, only requested fields are present
+class VenueView(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int | None = None
+
+    name: str | None = None
+    description: str | None = None
+    venue_type: str | None = None
+
+    lat: float | None = None
+    lng: float | None = None
+
+    work_hours_open: time | None = None
+    work_hours_close: time | None = None
+
+    num_likes: int | None = None
+
+    image_1_link: str | None = None
+    image_2_link: str | None = None
+    image_3_link: str | None = None
+
+    liked_by_me: bool | None = None
+
+# Listing item, liked_by_me is only present when the request is authenticated
+class VenueListItem(VenueInfo):
+    liked_by_me: bool | None = None
+
+class VenueNearby(BaseModel):
+    venue: VenueInfo
+    distance_km: float
+
+class VenueTrending(BaseModel):
+    venue: VenueInfo
+    score: float
 
 
 # Event
@@ -84,36 +140,39 @@ class EventCommentBase(BaseModel):
     event: int
 
 class EventCommentCreate(EventCommentBase):
-    content: str 
+    content: str
 
 class EventCommentDelete(BaseModel):
     id: int
 
 class EventCommentInfo(EventCommentBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
 
     content: str
     owner_id: int
     owner: UserInfo
 
-    created_at: time
+    created_at: datetime
 
 # Event: EventLike
 class EventLikeBase(BaseModel):
     event: int
 
 class EventLikeCreate(EventLikeBase):
-    pass 
+    pass
 
 class EventLikeInfo(EventLikeBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
 
     owner_id: int
-    owner: UserInfo
 
-    created_at: time
+    created_at: datetime
 
-# Event: Base    
+# Event: Base
 class EventBase(BaseModel):
     venue_id: int
     organizer_id: int
@@ -125,15 +184,103 @@ class EventBase(BaseModel):
     date: datetime
     start: time
     finish: time
-    
+
 
 class EventCreate(EventBase):
     poster_image_link: str
 
 class EventInfo(EventBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
 
+    start: time | None
+    finish: time | None
+    poster_image_link: str | None
+
     num_likes: int
-    comments: EventCommentInfo
 
-    created_at: time
+    created_at: datetime
+
+# Sparse read of an event, only requested fields and includes are present
+class EventView(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int | None = None
+
+    venue_id: int | None = None
+    organizer_id: int | None = None
+
+    title: str | None = None
+    description: str | None = None
+    event_type: str | None = None
+
+    date: datetime | None = None
+    start: time | None = None
+    finish: time | None = None
+    poster_image_link: str | None = None
+
+    num_likes: int | None = None
+
+    created_at: datetime | None = None
+
+    venue: VenueInfo | None = None
+    organizer: UserInfo | None = None
+
+    liked_by_me: bool | None = None
+
+# Listing item, liked_by_me is only present when the request is authenticated
+class EventListItem(EventInfo):
+    liked_by_me: bool | None = None
+
+class EventMapItem(BaseModel):
+    id: int
+
+    title: str
+    description: str
+    date: datetime
+    poster_image_link: str | None
+
+    venue_id: int
+    venue_name: str
+    lat: float
+    lng: float
+
+class CalendarDay(BaseModel):
+    day: date
+    events: list[EventInfo]
+
+class EventTrending(BaseModel):
+    event: EventInfo
+    score: float
+
+class EventRecommendation(BaseModel):
+    event: EventInfo
+    score: float
+
+
+# Search
+class SearchResult(BaseModel):
+    type: str
+    id: int
+    title: str
+    score: float
+
+
+# Bulk
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    inserted: int
+    failed: int
+    errors: list[ImportRowError]
+
+
+# Images
+class ImageInfo(BaseModel):
+    digest: str
+    content_type: str
+    url: str
+    variants: dict[str, str]
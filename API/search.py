@@ -0,0 +1,174 @@
+import asyncio
+import bisect
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from sqlalchemy import select
+
+from database import asyncSessionLocal
+from models import Event, Venue
+from settings import SEARCH_REFRESH_INTERVAL as REFRESH_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+TITLE_WEIGHT = 3
+PREFIX_PENALTY = 0.5
+MIN_PREFIX = 2
+
+# Azerbaijani letters folded to their Latin base so "Şəki", "SEKI" and "seki" all match;
+# dotted and dotless I are handled before lower() which would otherwise keep them apart
+UPPER_FOLD = str.maketrans({"İ": "i", "I": "i"})
+LOWER_FOLD = str.maketrans({"ə": "e", "ı": "i", "ö": "o", "ü": "u", "ş": "s", "ç": "c", "ğ": "g"})
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    text = text.translate(UPPER_FOLD).lower().translate(LOWER_FOLD)
+    text = unicodedata.normalize("NFKD", text)
+
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text: str | None) -> list[str]:
+    return TOKEN_RE.findall(fold(text)) if text else []
+
+
+class SearchIndex:
+    # Inverted index over event and venue titles/descriptions. Postings map a
+    # token to {doc: weighted term frequency}; a lazily re-sorted term list gives
+    # prefix matches by bisection
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.postings = defaultdict(dict)
+        self.docs = {}
+        self.terms = []
+        self.terms_dirty = False
+        self.last_ids = {"event": 0, "venue": 0}
+
+    def add(self, kind: str, item_id: int, title: str, description: str | None):
+        key = (kind, item_id)
+        self.remove(kind, item_id)
+
+        weights = Counter()
+        for token in tokenize(title):
+            weights[token] += TITLE_WEIGHT
+        for token in tokenize(description):
+            weights[token] += 1
+
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self.terms_dirty = True
+            self.postings[token][key] = weight
+
+        self.docs[key] = (title, tuple(weights))
+
+    def add_event(self, event):
+        self.add("event", event.id, event.title, event.description)
+
+    def add_venue(self, venue):
+        self.add("venue", venue.id, venue.name, venue.description)
+
+    def remove(self, kind: str, item_id: int):
+        key = (kind, item_id)
+        doc = self.docs.pop(key, None)
+
+        if doc is None:
+            return
+
+        for token in doc[1]:
+            posting = self.postings[token]
+            posting.pop(key, None)
+
+            if not posting:
+                del self.postings[token]
+                self.terms_dirty = True
+
+    def _expand(self, token: str, exact_only: bool) -> list[tuple[str, float]]:
+        matches = [(token, 1.0)] if token in self.postings else []
+
+        if exact_only or len(token) < MIN_PREFIX:
+            return matches
+
+        if self.terms_dirty:
+            self.terms = sorted(self.postings)
+            self.terms_dirty = False
+
+        start = bisect.bisect_left(self.terms, token)
+        for term in self.terms[start:]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                matches.append((term, PREFIX_PENALTY))
+
+        return matches
+
+    def search(self, query: str, kind: str | None = None, limit: int = 20):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        total = len(self.docs) or 1
+        scores = None
+
+        # Every query token has to match; only the last one may be a prefix
+        for position, token in enumerate(tokens):
+            token_scores = defaultdict(float)
+
+            for term, factor in self._expand(token, exact_only=position < len(tokens) - 1):
+                posting = self.postings[term]
+                idf = math.log(1 + total / len(posting))
+
+                for key, weight in posting.items():
+                    if kind is None or key[0] == kind:
+                        token_scores[key] = max(token_scores[key], factor * weight * idf)
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {key: score + token_scores[key] for key, score in scores.items()
+                    if key in token_scores}
+
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+        return [{"type": key[0], "id": key[1], "title": self.docs[key][0], "score": round(score, 4)}
+            for key, score in ranked]
+
+    async def catch_up(self, db):
+        # Picks up rows inserted since the last pass, including by other workers.
+        # Only rows read here move the watermark; this worker's own adds do
+        # not, or lower ids committed elsewhere meanwhile would be skipped
+        for kind, model, title in (("event", Event, Event.title), ("venue", Venue, Venue.name)):
+            rows = await db.stream(select(model.id, title, model.description)
+                .where(model.id > self.last_ids[kind]).order_by(model.id))
+
+            async for item_id, item_title, description in rows:
+                self.add(kind, item_id, item_title, description)
+                self.last_ids[kind] = item_id
+
+    async def rebuild(self, db):
+        self.clear()
+        await self.catch_up(db)
+
+
+search_index = SearchIndex()
+
+
+async def run_refresher(interval: float = REFRESH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            async with asyncSessionLocal() as db:
+                await search_index.catch_up(db)
+        except Exception:
+            logger.exception("Failed to refresh search index, will retry")
@@ -0,0 +1,116 @@
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+
+# Every setting is read from the environment here, once, with .env loaded first
+load_dotenv()
+
+
+def env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+def env_list(name: str, default: str = "") -> list[str]:
+    return [value.strip() for value in os.getenv(name, default).split(",") if value.strip()]
+
+
+# Database
+
+URL_DATABASE = os.getenv("URL_DATABASE")
+ASYNC_URL_DATABASE = os.getenv("ASYNC_URL_DATABASE")
+
+# Comma separated, sync or async URLs; reads from read-only handlers go here
+REPLICA_URL_DATABASES = env_list("REPLICA_URL_DATABASES")
+
+# After a write, that user's reads stay on the primary for this long so they
+# never see a replica that has not caught up with their own change yet; a
+# signed cookie carries it, so it holds whichever worker serves the read
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", "true")
+# Connections opened per engine at startup, capped at the pool size
+POOL_WARM = int(os.getenv("DB_POOL_WARM", "4"))
+
+# An empty database gets its tables at startup; any other unexpected schema
+# version refuses to start until migrate.py has run
+SCHEMA_AUTO_CREATE = env_flag("SCHEMA_AUTO_CREATE", "true")
+
+# Auth
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = os.getenv("ALGORITHM")
+
+# Resolved principals are cached per user id; with AUTH_TRUST_CLAIMS set the
+# signed token claims are used as-is and the users table is not read at all
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+AUTH_TRUST_CLAIMS = env_flag("AUTH_TRUST_CLAIMS")
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_CONCURRENCY = int(os.getenv("HASH_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+
+# Caches
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+
+FAVORITES_CACHE_USERS = int(os.getenv("FAVORITES_CACHE_USERS", "10000"))
+# Likes handled by other workers show up in a user's favorites once the entry expires
+FAVORITES_CACHE_TTL = float(os.getenv("FAVORITES_CACHE_TTL", "60"))
+
+# Likes and live updates
+
+LIKES_FLUSH_INTERVAL = float(os.getenv("LIKES_FLUSH_INTERVAL", "1.0"))
+
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "64"))
+LIVE_LIKES_INTERVAL = float(os.getenv("LIVE_LIKES_INTERVAL", "0.5"))
+LIVE_SEND_TIMEOUT = float(os.getenv("LIVE_SEND_TIMEOUT", "5"))
+
+# In-memory indexes
+
+SEARCH_REFRESH_INTERVAL = float(os.getenv("SEARCH_REFRESH_INTERVAL", "30"))
+
+TIMELINE_DAYS = int(os.getenv("TIMELINE_DAYS", "60"))
+TIMELINE_REFRESH_INTERVAL = float(os.getenv("TIMELINE_REFRESH_INTERVAL", "60"))
+
+TRENDING_HALF_LIFE = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "24")) * 3600
+TRENDING_TOP_K = int(os.getenv("TRENDING_TOP_K", "100"))
+TRENDING_REFRESH_INTERVAL = float(os.getenv("TRENDING_REFRESH_INTERVAL", "10"))
+TRENDING_PERSIST_INTERVAL = float(os.getenv("TRENDING_PERSIST_INTERVAL", "60"))
+# Unlikes only reach the worker that handled them (catch_up replays inserts),
+# so trending scores are recomputed from the like tables this often
+TRENDING_REBUILD_INTERVAL = float(os.getenv("TRENDING_REBUILD_INTERVAL", "3600"))
+
+RECOMMEND_NEIGHBORS = int(os.getenv("RECOMMEND_NEIGHBORS", "50"))
+RECOMMEND_TOP_N = int(os.getenv("RECOMMEND_TOP_N", "100"))
+RECOMMEND_CACHE_USERS = int(os.getenv("RECOMMEND_CACHE_USERS", "10000"))
+RECOMMEND_CACHE_TTL = float(os.getenv("RECOMMEND_CACHE_TTL", "300"))
+RECOMMEND_REFRESH_INTERVAL = float(os.getenv("RECOMMEND_REFRESH_INTERVAL", "30"))
+# Unlikes are only picked up by a full rebuild
+RECOMMEND_REBUILD_INTERVAL = float(os.getenv("RECOMMEND_REBUILD_INTERVAL", "3600"))
+
+# Images
+
+MEDIA_ROOT = Path(os.getenv("MEDIA_ROOT", "media"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 << 20)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Width times height; a small file can still decode into a huge bitmap
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+
+# Metrics
+
+# Requests issuing more statements than this are logged, 0 disables the warning
+QUERY_WARN_THRESHOLD = int(os.getenv("QUERY_WARN_THRESHOLD", "0"))
+
+# Startup
+
+# Requested once before the worker reports ready, so the first real requests
+# hit a warm response cache
+CACHE_WARM_PATHS = env_list("CACHE_WARM_PATHS",
+    "/events/all,/venues/all")
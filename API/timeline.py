@@ -0,0 +1,187 @@
+import asyncio
+import bisect
+import logging
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import select, func
+
+from database import asyncSessionLocal
+from models import Event
+from settings import TIMELINE_DAYS, TIMELINE_REFRESH_INTERVAL as REFRESH_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+
+def entry(event_id: int, event_date: datetime, start: time | None, finish: time | None) -> tuple:
+    # Events without times sort by their date's time and last until the end of
+    # the day; a finish before the start is on the next day
+    start = start or event_date.time()
+    end = datetime.combine(event_date.date(), finish or time.max)
+
+    if finish is not None and finish < start:
+        end += timedelta(days=1)
+
+    return (start, end, event_id)
+
+
+class EventTimeline:
+    # Event ids bucketed by day for today and the next TIMELINE_DAYS - 1 days,
+    # each bucket sorted by (start, end, id), plus yesterday's events that run
+    # past midnight. Only ids are kept, rows are loaded by primary key, so
+    # counters and edits are never stale
+    def __init__(self, days: int = TIMELINE_DAYS):
+        self.days = days
+        self.clear(date.today())
+
+    def clear(self, first_day: date):
+        self.first_day = first_day
+        self.buckets = {}
+        self.entries = {}
+        self.last_id = 0
+
+    @property
+    def end_day(self) -> date:
+        return self.first_day + timedelta(days=self.days)
+
+    def covers(self, first: date, last: date) -> bool:
+        return self.first_day <= first and last < self.end_day
+
+    def overnight(self, day: date, item: tuple) -> bool:
+        return day == self.first_day - timedelta(days=1) and item[1] > datetime.combine(self.first_day, time.min)
+
+    def add(self, event_id: int, event_date: datetime, start: time | None, finish: time | None):
+        day = event_date.date()
+        item = entry(event_id, event_date, start, finish)
+
+        if event_id in self.entries or day >= self.end_day:
+            return
+        if day < self.first_day and not self.overnight(day, item):
+            return
+
+        self.entries[event_id] = (day, item)
+        bisect.insort(self.buckets.setdefault(day, []), item)
+
+    def add_event(self, event):
+        self.add(event.id, event.date, event.start, event.finish)
+
+    def day(self, day: date) -> list[tuple]:
+        return self.buckets.get(day, [])
+
+    def between(self, first: date, last: date) -> dict[date, list[int]]:
+        days = {}
+
+        for offset in range((last - first).days + 1):
+            day = first + timedelta(days=offset)
+            if day in self.buckets:
+                days[day] = [event_id for _, _, event_id in self.buckets[day]]
+
+        return days
+
+    def position(self, event_id: int) -> tuple | None:
+        return self.entries.get(event_id)
+
+    def upcoming(self, now: datetime, after: tuple | None, limit: int) -> list[int]:
+        # Events that have not finished yet in calendar order, resuming after
+        # the position of the previous page's last event
+        items = []
+        yesterday = now.date() - timedelta(days=1)
+
+        for offset in range(-1, self.days):
+            day = self.first_day + timedelta(days=offset)
+            if day < yesterday or day not in self.buckets or (after and day < after[0]):
+                continue
+
+            bucket = self.buckets[day]
+            start = bisect.bisect_right(bucket, after[1]) if after and day == after[0] else 0
+
+            for item in bucket[start:]:
+                if item[1] <= now:
+                    continue
+
+                items.append(item[2])
+                if len(items) >= limit:
+                    return items
+
+        return items
+
+    def happening(self, now: datetime) -> list[int]:
+        # Yesterday's bucket holds the events still running past midnight
+        days = (now.date() - timedelta(days=1), now.date())
+
+        return [event_id for day in days for start, end, event_id in self.day(day)
+            if datetime.combine(day, start) <= now < end]
+
+    async def load(self, db, first: date, last: date):
+        rows = await db.stream(select(Event.id, Event.date, Event.start, Event.finish)
+            .where(Event.date >= datetime.combine(first, time.min),
+                Event.date < datetime.combine(last, time.min))
+            .order_by(Event.date, Event.start, Event.id))
+
+        async for row in rows:
+            self.add(*row)
+
+    async def catch_up(self, db):
+        # New ids since the last pass, created by bulk imports or other workers.
+        # Local add_event() calls leave the watermark alone, or lower ids
+        # committed elsewhere meanwhile would be skipped
+        rows = await db.stream(select(Event.id, Event.date, Event.start, Event.finish)
+            .where(Event.id > self.last_id).order_by(Event.id))
+
+        async for row in rows:
+            self.add(*row)
+            self.last_id = row.id
+
+    async def rebuild(self, db, today: date | None = None):
+        self.clear(today or date.today())
+
+        # Later ids are picked up by catch_up(), earlier ones outside the window by roll()
+        self.last_id = await db.scalar(select(func.max(Event.id))) or 0
+        await self.load(db, self.first_day - timedelta(days=1), self.end_day)
+
+    async def roll(self, db, today: date | None = None):
+        # Drops the days that passed and loads the ones that entered the window
+        today = today or date.today()
+        if today <= self.first_day:
+            return
+
+        if today >= self.end_day:
+            return await self.rebuild(db, today)
+
+        old_end = self.end_day
+        self.first_day = today
+
+        for day in [day for day in self.buckets if day < today]:
+            kept = []
+            for item in self.buckets.pop(day):
+                if self.overnight(day, item):
+                    kept.append(item)
+                else:
+                    del self.entries[item[2]]
+
+            if kept:
+                self.buckets[day] = kept
+
+        await self.load(db, old_end, self.end_day)
+
+
+event_timeline = EventTimeline()
+
+
+def seconds_to_midnight(now: datetime) -> float:
+    midnight = datetime.combine(now.date() + timedelta(days=1), time.min)
+
+    return (midnight - now).total_seconds()
+
+
+async def run_refresher(interval: float = REFRESH_INTERVAL):
+    while True:
+        # Wakes just after midnight so the window rolls forward on time
+        await asyncio.sleep(min(interval, seconds_to_midnight(datetime.now()) + 1))
+
+        try:
+            async with asyncSessionLocal() as db:
+                await event_timeline.roll(db)
+                await event_timeline.catch_up(db)
+        except Exception:
+            logger.exception("Failed to refresh event timeline, will retry")
@@ -0,0 +1,232 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import select, delete, insert, func
+
+from database import asyncSessionLocal
+from models import EventLike, VenueLike, TrendingScore
+from settings import (TRENDING_HALF_LIFE as HALF_LIFE, TRENDING_TOP_K as TOP_K,
+    TRENDING_REFRESH_INTERVAL as REFRESH_INTERVAL, TRENDING_PERSIST_INTERVAL as PERSIST_INTERVAL,
+    TRENDING_REBUILD_INTERVAL as REBUILD_INTERVAL)
+
+
+logger = logging.getLogger(__name__)
+
+# Scores below this (in likes, as of now) are dropped when persisting
+MIN_SCORE = 0.01
+# Likes older than this many half-lives weigh under 0.1% and are not replayed
+HORIZON_HALF_LIVES = 10
+# Forward scores are rescaled before exp() gets anywhere near overflowing
+MAX_EXPONENT = 50
+
+
+def timestamp(value: datetime) -> float:
+    # Naive database timestamps are UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+
+    return value.timestamp()
+
+
+class TrendingRanking:
+    # Exponentially decayed like counts. Scores use forward decay: a like at t
+    # adds exp(rate * (t - epoch)), so existing scores never need touching as
+    # time passes and the order only changes on likes. The top K ids are kept
+    # sorted, reads are O(K)
+    def __init__(self, kind: str, like_model, target_column, half_life: float = HALF_LIFE,
+            top_k: int = TOP_K):
+        self.kind = kind
+        self.like_model = like_model
+        self.target_column = target_column
+        self.rate = math.log(2) / half_life
+        self.top_k = top_k
+        self.clear()
+
+    def clear(self, epoch: float | None = None):
+        self.epoch = epoch or time.time()
+        self.scores = {}
+        self.top = []
+        self.last_like_id = 0
+        # Likes above the watermark that record() already counted, by id
+        self.applied = {}
+
+    def _rebase(self, now: float):
+        exponent = self.rate * (now - self.epoch)
+        if exponent < MAX_EXPONENT:
+            return
+
+        factor = math.exp(-exponent)
+        self.scores = {item_id: score * factor for item_id, score in self.scores.items()}
+        self.epoch = now
+
+    def _rank(self):
+        self.top = heapq.nlargest(self.top_k, self.scores, key=self.scores.__getitem__)
+
+    def add(self, item_id: int, at: float, weight: int = 1):
+        self._rebase(max(at, time.time()))
+
+        score = self.scores.get(item_id, 0.0) + weight * math.exp(self.rate * (at - self.epoch))
+        if score > 0:
+            self.scores[item_id] = score
+        else:
+            self.scores.pop(item_id, None)
+
+        if item_id in self.top:
+            if weight < 0:
+                # Something outside the top may now outrank it
+                return self._rank()
+            self.top.remove(item_id)
+
+        elif weight < 0 or (len(self.top) >= self.top_k and score <= self.scores[self.top[-1]]):
+            return
+
+        position = len(self.top)
+        while position and self.scores[self.top[position - 1]] < score:
+            position -= 1
+
+        self.top.insert(position, item_id)
+        del self.top[self.top_k:]
+
+    def record(self, item_id: int, like_id: int):
+        # Called by the like handler right after its commit
+        if like_id > self.last_like_id:
+            at = time.time()
+            self.applied[like_id] = (item_id, at)
+            self.add(item_id, at)
+
+    def retract(self, item_id: int, liked_at: datetime):
+        # Local only; other workers see the unlike at their next rebuild()
+        self.add(item_id, timestamp(liked_at), -1)
+
+    def trending(self, limit: int) -> list[tuple[int, float]]:
+        decay = math.exp(-self.rate * (time.time() - self.epoch))
+
+        return [(item_id, self.scores[item_id] * decay) for item_id in self.top[:limit]]
+
+    async def catch_up(self, db, since: datetime | None = None):
+        # Likes committed by other workers or bulk imports; this worker's own
+        # likes were applied by record() already
+        stmt = (select(self.like_model.id, self.target_column, self.like_model.created_at)
+            .where(self.like_model.id > self.last_like_id).order_by(self.like_model.id))
+
+        if since is not None:
+            stmt = stmt.where(self.like_model.created_at >= since)
+
+        rows = await db.stream(stmt)
+
+        async for like_id, item_id, created_at in rows:
+            if like_id in self.applied:
+                del self.applied[like_id]
+            else:
+                self.add(item_id, timestamp(created_at))
+            self.last_like_id = like_id
+
+        self.applied = {like_id: like for like_id, like in self.applied.items()
+            if like_id > self.last_like_id}
+
+    async def load(self, db):
+        rows = (await db.execute(select(TrendingScore)
+            .where(TrendingScore.kind == self.kind))).scalars().all()
+
+        if rows:
+            # Persisted scores are decayed to updated_at, which becomes the epoch
+            self.clear(timestamp(rows[0].updated_at))
+            self.scores = {row.item_id: row.score for row in rows}
+            self.last_like_id = rows[0].like_id
+            self._rank()
+            return await self.catch_up(db)
+
+        await self.rebuild(db)
+
+    async def rebuild(self, db):
+        # Replays the likes that still exist into a fresh ranking and swaps it
+        # in, so reads never see a partial one. Likes recorded here meanwhile
+        # are above its watermark and come back through the next catch_up()
+        fresh = TrendingRanking(self.kind, self.like_model, self.target_column,
+            math.log(2) / self.rate, self.top_k)
+
+        horizon = datetime.fromtimestamp(
+            time.time() - HORIZON_HALF_LIVES * math.log(2) / self.rate, timezone.utc).replace(tzinfo=None)
+        await fresh.catch_up(db, since=horizon)
+        fresh.last_like_id = max(fresh.last_like_id,
+            await db.scalar(select(func.max(self.like_model.id))) or 0)
+
+        self.epoch, self.scores, self.top = fresh.epoch, fresh.scores, fresh.top
+        self.last_like_id, self.applied = fresh.last_like_id, fresh.applied
+
+    async def persist(self, db):
+        # Moves the watermark past the likes record() counted, load() replays
+        # everything above the stored like_id
+        await self.catch_up(db)
+
+        now = time.time()
+        decay = math.exp(-self.rate * (now - self.epoch))
+
+        self.scores = {item_id: score for item_id, score in self.scores.items()
+            if score * decay >= MIN_SCORE}
+        self._rank()
+
+        # Likes recorded while catching up are still above it, so their share
+        # is left out of the stored scores instead of being counted twice
+        pending = defaultdict(float)
+        for item_id, at in self.applied.values():
+            pending[item_id] += math.exp(self.rate * (at - self.epoch))
+
+        updated_at = datetime.fromtimestamp(now, timezone.utc).replace(tzinfo=None)
+        rows = [dict(kind=self.kind, item_id=item_id, score=(score - pending[item_id]) * decay,
+                like_id=self.last_like_id, updated_at=updated_at)
+            for item_id, score in self.scores.items()
+            if (score - pending[item_id]) * decay >= MIN_SCORE]
+
+        await db.execute(delete(TrendingScore).where(TrendingScore.kind == self.kind))
+        if rows:
+            await db.execute(insert(TrendingScore), rows)
+        await db.commit()
+
+
+trending_events = TrendingRanking("event", EventLike, EventLike.event)
+trending_venues = TrendingRanking("venue", VenueLike, VenueLike.venue)
+
+RANKINGS = (trending_events, trending_venues)
+
+
+async def load_all():
+    async with asyncSessionLocal() as db:
+        for ranking in RANKINGS:
+            await ranking.load(db)
+
+
+async def persist_all():
+    async with asyncSessionLocal() as db:
+        for ranking in RANKINGS:
+            await ranking.persist(db)
+
+
+async def run_refresher(interval: float = REFRESH_INTERVAL, persist_interval: float = PERSIST_INTERVAL,
+        rebuild_interval: float = REBUILD_INTERVAL):
+    persisted = rebuilt = time.monotonic()
+
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            async with asyncSessionLocal() as db:
+                if time.monotonic() - rebuilt >= rebuild_interval:
+                    for ranking in RANKINGS:
+                        await ranking.rebuild(db)
+                    rebuilt = time.monotonic()
+                else:
+                    for ranking in RANKINGS:
+                        await ranking.catch_up(db)
+
+            if time.monotonic() - persisted >= persist_interval:
+                await persist_all()
+                persisted = time.monotonic()
+
+        except Exception:
+            logger.exception("Failed to refresh trending scores, will retry")
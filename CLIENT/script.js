@@ -67,30 +67,24 @@ function initMiniMap(location) {
     });
 }
 
-function fetchNearbyPlaces(location) {
-    const service = new google.maps.places.PlacesService(map);
-    const request = {
-        location: location,
-        radius: '500',
-        type: 'museum'
-    };
-
-    service.nearbySearch(request, processResults);
-}
-
-function processResults(results, status, pagination) {
-    if (status === google.maps.places.PlacesServiceStatus.OK) {
-        for (let i = 0; i < results.length; i++) {
-            createMarker(results[i]);
-        }
-
-        if (pagination && pagination.hasNextPage) {
-            setTimeout(() => {
-                pagination.nextPage();
-            }, 2000);
+async function fetchNearbyPlaces(location) {
+    try {
+        const response = await fetch(
+            `http://localhost:8000/venues/nearby?lat=${location.lat}&lng=${location.lng}&radius=0.5`);
+        const nearby = await response.json();
+
+        for (const { venue } of nearby) {
+            createMarker({
+                place_id: venue.id,
+                geometry: {
+                    location: new google.maps.LatLng(venue.lat, venue.lng),
+                },
+                name: venue.name,
+                vicinity: venue.name,
+            });
         }
-    } else {
-        console.error('Places request failed due to ' + status);
+    } catch (error) {
+        console.error('Nearby venues request failed:', error);
     }
 }
 
@@ -200,9 +194,17 @@ function drawRoute(place) {
 // Events
 
 // Get
+// Uploaded images are content addressed, list views ask for the small variant
+function thumbnail(link) {
+    if (link && link.startsWith("/images/")) {
+        return `http://localhost:8000${link}?variant=thumb`;
+    }
+    return link;
+}
+
 async function getEvents() {
     try {
-        const response = await fetch("http://localhost:8000/events/all");
+        const response = await fetch("http://localhost:8000/events/map");
         const events = await response.json();
 
         const eventsContainer = document.querySelector(".upcoming-events");
@@ -216,7 +218,7 @@ async function getEvents() {
             eventElement.style.cursor = "pointer";
 
             const eventImage = document.createElement("img");
-            eventImage.src = event.poster_image_link;
+            eventImage.src = thumbnail(event.poster_image_link);
             eventImage.alt = event.title;
             eventImage.classList.add("event-image");
             eventImage.style.marginRight = "20px";
@@ -248,22 +250,16 @@ async function getEvents() {
             eventElement.appendChild(eventTextContainer);
             eventsContainer.appendChild(eventElement);
 
-            const responsex = await fetch(`http://localhost:8000/events/${event.id}`);
-            const marked_event = await responsex.json();
-
-            const respond_venues = await fetch(`http://localhost:8000/venues/${marked_event.venue_id}`);
-            const marked_venue = await respond_venues.json();
-
-            const lat = parseFloat(marked_venue.lat);
-            const lng = parseFloat(marked_venue.lng);
+            const lat = parseFloat(event.lat);
+            const lng = parseFloat(event.lng);
 
             if (!isNaN(lat) || !isNaN(lng)){
                 const marker = createMarker({
                     geometry: {
                         location: new google.maps.LatLng(lat, lng),
                     },
-                    name: marked_event.title,
-                    vicinity: marked_venue.name || "Unknown location"
+                    name: event.title,
+                    vicinity: event.venue_name || "Unknown location"
                 }, true);
 
                 eventElement.addEventListener("click", () => {
@@ -271,6 +267,10 @@ async function getEvents() {
                     map.setCenter(marker.getPosition());
                 });
             }
+
+            eventElement.addEventListener("click", () => {
+                watchEvent(event.id, eventTextContainer);
+            });
         }
     } catch (error) {
         console.error("Error fetching events:", error);
@@ -324,6 +324,53 @@ async function getEventComment(comment_id) {
     }
 }
 
+// Live
+
+function subscribeEvent(event_id, onMessage) {
+    const socket = new WebSocket(`ws://localhost:8000/events/${event_id}/live`);
+
+    socket.addEventListener("message", (message) => {
+        onMessage(JSON.parse(message.data));
+    });
+
+    return socket;
+}
+
+// The selected event in the list follows its like count while it stays selected
+let liveSocket = null;
+
+async function watchEvent(event_id, container) {
+    if (liveSocket) {
+        liveSocket.close();
+    }
+
+    let likes = container.querySelector(".event-likes");
+    if (!likes) {
+        likes = document.createElement("p");
+        likes.classList.add("event-likes");
+        container.appendChild(likes);
+    }
+
+    try {
+        const response = await fetch('http://localhost:8000/events/' + event_id);
+        const event = await response.json();
+
+        let count = event.num_likes || 0;
+        likes.innerHTML = `<strong>Likes:</strong> ${count}`;
+
+        liveSocket = subscribeEvent(event_id, (message) => {
+            if (message.type === "likes") {
+                count += message.delta;
+                likes.innerHTML = `<strong>Likes:</strong> ${count}`;
+            } else {
+                console.log(message);
+            }
+        });
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
 // Post
 
 async function createEvent(inputData) {
@@ -412,7 +459,7 @@ function drawRoute(place) {
 async function getVenues() {
     try {
         const response = await fetch('http://localhost:8000/venues/all');
-        const venues = await response.json();
+        const { items: venues } = await response.json();
         
         const venuesContainer = document.querySelector(".main_left2");
 
@@ -421,7 +468,7 @@ async function getVenues() {
             venueElement.className = "left2_imgs"
 
             const venueImage = document.createElement("img");
-            venueImage.src = venue.image_1_link;
+            venueImage.src = thumbnail(venue.image_1_link);
             venueImage.alt = venue.name;
 
             const venueStarElement = document.createElement("div");